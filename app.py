@@ -1,12 +1,32 @@
+import time
+
+# Mốc bắt đầu chạy script; lần chạy đầu tiên của process gồm cả thời gian import (dùng để đo cold start)
+SCRIPT_STARTED = time.monotonic()
+
 import streamlit as st
-from google.oauth2 import service_account
-from google.cloud import bigquery
 import pandas as pd
 import os
-import math
-import requests
+import logging
+import hashlib
+import hmac
+import secrets
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
 from typing import Dict, List, Optional
-from math import ceil
+
+from bigquery_utils import (
+    QueryResultCache, build_query_sql, create_bigquery_client, dry_run_query, normalize_query, read_table_rows,
+    run_query, validate_query
+)
+from exports import EXPORT_FORMATS, export_result
+from larkbase import (
+    LarkbaseAuthenticator, LarkbaseConfig, LarkbaseHttpClient, LarkbaseRateGovernor, LarkbaseRecordManager,
+    LarkbaseTokenCache
+)
+from metrics import MetricsRegistry, log_event, serve_metrics, track_phase
+from result_store import ResultHandle, SessionResultStore
+from sync import SYNC_MODES, SyncCheckpoint, SyncCheckpointStore, SyncJob, SyncJobManager, run_larkbase_sync
 
 # Cấu hình trang
 st.set_page_config(
@@ -46,318 +66,387 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Larkbase Configuration
-class LarkbaseConfig:
-    def __init__(self, app_id=None, app_secret=None, api_endpoint=None):
-        self.app_id = app_id or 'cli_a7fab27260385010'
-        self.app_secret = app_secret or 'Zg4MVcFfiOu0g09voTcpfd4WGDpA0Ly5'
-        self.api_endpoint = api_endpoint or 'https://open.larksuite.com/open-apis'
-    
-    def to_dict(self) -> Dict:
-        return {
-            'app_id': self.app_id,
-            'app_secret': self.app_secret,
-            'api_endpoint': self.api_endpoint
-        }
-
-class LarkbaseAuthenticator:
-    def __init__(self, config: LarkbaseConfig):
-        self.config = config
-    
-    def authenticate(self) -> Optional[str]:
-        """Xác thực với API Larkbase để lấy access token"""
-        try:
-            url = f"{self.config.api_endpoint}/auth/v3/tenant_access_token/internal"
-            response = requests.post(url, json={
-                'app_id': self.config.app_id, 
-                'app_secret': self.config.app_secret
-            })
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get('code') == 0:
-                return data.get('tenant_access_token')
-            else:
-                st.error(f"Lỗi API Larkbase: {data.get('msg', 'Không xác định')}")
-                return None
-        except Exception as e:
-            st.error(f"Lỗi xác thực Larkbase: {str(e)}")
-            return None
+logger = logging.getLogger(__name__)
 
-class LarkbaseRecordManager:
-    def __init__(self, access_token: str, config: LarkbaseConfig):
-        self.access_token = access_token
-        self.config = config
-    
-    def get_all_records(self, app_token: str, table_id: str) -> List[str]:
-        """Lấy tất cả record IDs từ bảng"""
-        url = f"{self.config.api_endpoint}/bitable/v1/apps/{app_token}/tables/{table_id}/records"
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json"
-        }
-        
-        all_record_ids = []
-        page_token = None
-        
-        while True:
-            params = {"page_size": 500}
-            if page_token:
-                params["page_token"] = page_token
-            
-            response = requests.get(url, headers=headers, params=params)
-            
-            try:
-                data = response.json()
-                if data.get('code') == 0:
-                    records = data.get('data', {}).get('items', [])
-                    record_ids = [record.get('record_id') for record in records]
-                    all_record_ids.extend(record_ids)
-                    
-                    # Kiểm tra có trang tiếp theo không
-                    page_token = data.get('data', {}).get('page_token')
-                    if not page_token:
-                        break
-                else:
-                    st.error(f"Lỗi lấy records: {data.get('msg')}")
-                    break
-            except Exception as e:
-                st.error(f"Lỗi parse response: {str(e)}")
-                break
-        
-        return all_record_ids
-    
-    def batch_delete_records(self, records: List[str], app_token: str, table_id: str) -> Dict:
-        """Xóa nhiều record khỏi bảng trên Lark Bitable"""
-        if not records:
-            return {"status": "no_records", "message": "Không có record nào để xóa."}
-
-        url = f"{self.config.api_endpoint}/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_delete"
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json"
-        }
-
-        batch_size = 500
-        total_records = len(records)
-        total_batches = ceil(total_records / batch_size)
-        results = []
-        errors = []
-
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-
-        for i in range(total_batches):
-            batch = records[i * batch_size:(i + 1) * batch_size]
-            data = {"records": batch}
-            response = requests.post(url, headers=headers, json=data)
-            
-            try:
-                result = response.json()
-                results.append(result)
-                if response.status_code != 200 or result.get("code", 0) != 0:
-                    errors.append({
-                        "batch_index": i,
-                        "status_code": response.status_code,
-                        "response": result
-                    })
-                    status_text.text(f"Batch {i+1}/{total_batches}: Lỗi xóa {len(batch)} bản ghi")
-                else:
-                    status_text.text(f"Batch {i+1}/{total_batches}: Xóa thành công {len(batch)} bản ghi")
-            except Exception as e:
-                errors.append({
-                    "batch_index": i,
-                    "status_code": response.status_code,
-                    "exception": str(e)
-                })
-                status_text.text(f"Batch {i+1}/{total_batches}: Lỗi xóa")
-            
-            progress_bar.progress((i + 1) / total_batches)
-
-        summary = {
-            "total_batches": total_batches,
-            "total_records": total_records,
-            "success_batches": total_batches - len(errors),
-            "error_batches": len(errors),
-            "results": results,
-            "errors": errors
-        }
-
-        return summary
-    
-    def batch_create_records(self, records: List[Dict], app_token: str, table_id: str, batch_size: int = 500) -> List[Dict]:
-        """Tạo nhiều record mới trong bảng trên Lark Bitable"""
-        if not records:
-            return [{"status": "no_records", "message": "Không có record nào để tạo."}]
-
-        url = f"{self.config.api_endpoint}/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_create"
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json"
-        }
-
-        total_records = len(records)
-        total_batches = ceil(total_records / batch_size)
-        results = []
-
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-
-        for i in range(0, total_batches):
-            start_idx = i * batch_size
-            end_idx = min((i + 1) * batch_size, total_records)
-            batch = records[start_idx:end_idx]
-            
-            # Chuẩn bị dữ liệu cho API Larkbase
-            formatted_batch = []
-            for record in batch:
-                formatted_record = {"fields": {}}
-                for key, value in record.items():
-                    # Chuyển đổi giá trị thành format phù hợp với Larkbase
-                    if pd.isna(value):
-                        formatted_record["fields"][key] = ""
-                    elif isinstance(value, (int, float)):
-                        formatted_record["fields"][key] = value
-                    else:
-                        formatted_record["fields"][key] = str(value)
-                formatted_batch.append(formatted_record)
-            
-            data = {"records": formatted_batch}
-            response = requests.post(url, headers=headers, json=data)
-            
-            try:
-                res_json = response.json()
-                if res_json.get('code') == 0:
-                    result = {
-                        "status": "success", 
-                        "batch": i+1, 
-                        "created_count": len(res_json['data']['records'])
-                    }
-                    status_text.text(f"Batch {i+1}/{total_batches}: Tạo thành công {len(batch)} bản ghi")
-                else:
-                    result = {
-                        "status": "error", 
-                        "batch": i+1, 
-                        "msg": res_json.get('msg'), 
-                        "code": res_json.get('code')
-                    }
-                    status_text.text(f"Batch {i+1}/{total_batches}: Lỗi - {res_json.get('msg')}")
-            except Exception as e:
-                result = {
-                    "status": "error", 
-                    "batch": i+1, 
-                    "status_code": response.status_code, 
-                    "exception": str(e)
-                }
-                status_text.text(f"Batch {i+1}/{total_batches}: Lỗi - {str(e)}")
-            
-            results.append(result)
-            progress_bar.progress((i + 1) / total_batches)
+@st.cache_resource
+def get_metrics_registry() -> MetricsRegistry:
+    """Registry metrics dùng chung cho toàn bộ process"""
+    return MetricsRegistry()
+
+@st.cache_resource
+def start_metrics_server() -> Optional[ThreadingHTTPServer]:
+    """Mở endpoint /metrics (Prometheus) trên METRICS_PORT, một lần cho mỗi process"""
+    port = os.getenv('METRICS_PORT')
+    if not port:
+        return None
+    return serve_metrics(get_metrics_registry(), int(port))
+
+@st.cache_resource
+def get_larkbase_rate_governor() -> LarkbaseRateGovernor:
+    """Rate governor dùng chung cho toàn bộ process (mọi session Streamlit)"""
+    governor = LarkbaseRateGovernor()
+    get_metrics_registry().register_gauge(
+        "larkbase_rate_queue_depth",
+        lambda: [({"app_id": s["app_id"], "endpoint": s["endpoint"]}, s["queue_depth"]) for s in governor.stats()],
+        "Số request Larkbase đang chờ lượt"
+    )
+    return governor
+
+@st.cache_resource
+def get_larkbase_http_client() -> LarkbaseHttpClient:
+    """HTTP client dùng chung cho toàn bộ process (mọi session Streamlit)"""
+    return LarkbaseHttpClient(governor=get_larkbase_rate_governor(), metrics=get_metrics_registry())
+
+@st.cache_resource
+def get_larkbase_token_cache() -> LarkbaseTokenCache:
+    """Token cache dùng chung cho toàn bộ process"""
+    return LarkbaseTokenCache()
+
+@st.cache_resource
+def get_startup_state() -> Dict:
+    """Mốc thời gian khởi động của process (lần chạy script đầu tiên)"""
+    return {"script_started": SCRIPT_STARTED, "first_paint_pending": True}
+
+def record_startup_stage(metrics: MetricsRegistry, stage: str, script_started: float):
+    """Ghi thời gian từ lần chạy script đầu tiên tới khi một giai đoạn khởi động hoàn tất"""
+    seconds = time.monotonic() - script_started
+    metrics.observe("startup_seconds", seconds, "Thời gian khởi động theo giai đoạn", stage=stage)
+    log_event("startup", f"startup {stage} after {seconds:.3f}s", stage=stage, seconds=round(seconds, 4))
+
+def record_first_paint():
+    """Ghi thời gian tới lần vẽ trang đầu tiên (một lần mỗi process)"""
+    state = get_startup_state()
+    if state.pop("first_paint_pending", False):
+        record_startup_stage(get_metrics_registry(), "first_paint", state["script_started"])
+
+def _warmup_bigquery_client(metrics: MetricsRegistry, script_started: float):
+    with track_phase(metrics, "warmup_bigquery_client"):
+        # Trên Cloud Run dùng service account của service, ở local đọc từ secrets của Streamlit
+        client = create_bigquery_client(None if os.getenv('K_SERVICE') else st.secrets["gcp_service_account"])
+    record_startup_stage(metrics, "bigquery_client", script_started)
+    return client
+
+def _warmup_larkbase_token(authenticator: LarkbaseAuthenticator, metrics: MetricsRegistry,
+                           script_started: float) -> Optional[str]:
+    token = authenticator.authenticate()
+    if token:
+        record_startup_stage(metrics, "larkbase_token", script_started)
+    return token
 
-        return results
+@st.cache_resource(show_spinner=False)
+def start_warmup() -> Dict[str, Future]:
+    """Khởi tạo BigQuery client và lấy sẵn access token Larkbase trong thread nền (một lần mỗi process),
+    để trang hiển thị ngay thay vì chờ import google-cloud-bigquery và tìm credentials"""
+    metrics = get_metrics_registry()
+    script_started = get_startup_state()["script_started"]
+    authenticator = LarkbaseAuthenticator(LarkbaseConfig(), get_larkbase_http_client(), get_larkbase_token_cache())
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='warmup')
+    futures = {
+        "bigquery": executor.submit(_warmup_bigquery_client, metrics, script_started),
+        "larkbase": executor.submit(_warmup_larkbase_token, authenticator, metrics, script_started)
+    }
+    executor.shutdown(wait=False)
+    return futures
 
-# BigQuery functions (giữ nguyên như cũ)
 @st.cache_resource
 def init_bigquery_client():
-    """Khởi tạo BigQuery client"""
+    """BigQuery client (khởi tạo nền bởi start_warmup, chỉ chờ nếu chưa xong)"""
     try:
-        if os.getenv('K_SERVICE'):
-            from google.auth import default
-            credentials, project = default()
-            return bigquery.Client(credentials=credentials, project=project)
-        else:
-            credentials = service_account.Credentials.from_service_account_info(
-                st.secrets["gcp_service_account"]
-            )
-            return bigquery.Client(credentials=credentials)
+        return start_warmup()["bigquery"].result()
     except Exception as e:
         st.error(f"❌ Lỗi kết nối BigQuery: {e}")
         return None
 
-@st.cache_data(ttl=300)
-def run_bigquery_query(query, limit=1000):
-    """Thực thi query và trả về kết quả dạng DataFrame"""
+@st.cache_resource
+def get_query_cache() -> QueryResultCache:
+    """Cache kết quả query dùng chung cho toàn bộ process"""
+    return QueryResultCache()
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_estimate(query: str, limit: int = 1000, columns: Optional[List[str]] = None) -> Dict:
+    """Dry-run có cache; lỗi được raise (st.cache_data không cache lần gọi bị exception)"""
+    client = init_bigquery_client()
+    if client is None:
+        raise RuntimeError("Không thể kết nối đến BigQuery")
+    estimate = dry_run_query(client, query, limit, columns)
+    if estimate.get("error"):
+        raise RuntimeError(estimate["error"])
+    return estimate
+
+def estimate_query(query: str, limit: int = 1000, columns: Optional[List[str]] = None) -> Dict:
+    """Dry-run query để ước tính bytes xử lý, chi phí và bảng được tham chiếu trước khi thực thi.
+    Chỉ ước tính thành công mới được cache, lỗi tạm thời không chặn nút Execute trong 5 phút"""
+    try:
+        return _cached_estimate(query, limit, columns)
+    except Exception as e:
+        return {"error": str(e)}
+
+def run_bigquery_query(query, limit=1000, columns: Optional[List[str]] = None, cache_ttl: Optional[int] = None):
+    """Thực thi query và trả về kết quả dạng DataFrame (ưu tiên đọc từ cache trên đĩa)"""
     client = init_bigquery_client()
     if client is None:
         return None
-    
     try:
-        query_upper = query.upper().strip()
-        if not 'LIMIT' in query_upper:
-            query = f"{query.rstrip(';')} LIMIT {limit}"
-        
-        job_config = bigquery.QueryJobConfig(
-            maximum_bytes_billed=100 * 1024 * 1024,  # 100MB limit
-            use_query_cache=True
-        )
-        
-        query_job = client.query(query, job_config=job_config)
-        df = query_job.to_dataframe()
-        return df
+        return run_query(client, query, limit, columns, cache=get_query_cache(), cache_ttl=cache_ttl,
+                         metrics=get_metrics_registry())
     except Exception as e:
         st.error(f"❌ Lỗi thực thi query: {e}")
         return None
 
-def validate_query(query):
-    """Kiểm tra tính hợp lệ của SQL query"""
-    dangerous_keywords = ['DELETE', 'DROP', 'TRUNCATE', 'INSERT', 'UPDATE', 'ALTER', 'CREATE']
-    query_upper = query.upper()
-    
-    for keyword in dangerous_keywords:
-        if keyword in query_upper:
-            return False, f"Query chứa từ khóa nguy hiểm: {keyword}"
-    
-    if not query.strip().upper().startswith('SELECT'):
-        return False, "Query phải bắt đầu bằng SELECT"
-    
-    return True, "Query hợp lệ"
+# Số dòng mỗi trang của bảng kết quả
+RESULT_PAGE_SIZE = 10
 
-def paginate_dataframe(df, page_size=10):
-    """Chia DataFrame thành các trang"""
-    if 'current_page' not in st.session_state:
-        st.session_state.current_page = 0
-    
-    total_pages = math.ceil(len(df) / page_size)
+def _set_page(page: int):
+    st.session_state.current_page = page
+
+def paginate_result(result: ResultHandle, page_size: int = RESULT_PAGE_SIZE) -> int:
+    """Nút chuyển trang; trả về trang hiện tại. Số trang lấy từ handle nên không phải quét dữ liệu,
+    và nút chỉ đổi số trang qua callback (không gọi st.rerun chạy lại script thêm lần nữa)"""
+    total_pages = result.page_count(page_size)
+    current_page = min(max(st.session_state.get('current_page', 0), 0), max(total_pages - 1, 0))
+    st.session_state.current_page = current_page
     
     if total_pages > 1:
         col1, col2, col3, col4, col5 = st.columns([1, 1, 2, 1, 1])
         
         with col1:
-            if st.button("⏮️ Đầu", disabled=st.session_state.current_page == 0):
-                st.session_state.current_page = 0
-                st.rerun()
+            st.button("⏮️ Đầu", disabled=current_page == 0, on_click=_set_page, args=(0,))
         
         with col2:
-            if st.button("◀️ Trước", disabled=st.session_state.current_page == 0):
-                st.session_state.current_page -= 1
-                st.rerun()
+            st.button("◀️ Trước", disabled=current_page == 0, on_click=_set_page, args=(current_page - 1,))
         
         with col3:
-            st.markdown(f"<div class='metric-container'>Trang {st.session_state.current_page + 1} / {total_pages}</div>", 
+            st.markdown(f"<div class='metric-container'>Trang {current_page + 1:,} / {total_pages:,}</div>", 
                        unsafe_allow_html=True)
         
         with col4:
-            if st.button("▶️ Sau", disabled=st.session_state.current_page >= total_pages - 1):
-                st.session_state.current_page += 1
-                st.rerun()
+            st.button("▶️ Sau", disabled=current_page >= total_pages - 1, on_click=_set_page,
+                      args=(current_page + 1,))
         
         with col5:
-            if st.button("⏭️ Cuối", disabled=st.session_state.current_page >= total_pages - 1):
-                st.session_state.current_page = total_pages - 1
-                st.rerun()
+            st.button("⏭️ Cuối", disabled=current_page >= total_pages - 1, on_click=_set_page,
+                      args=(total_pages - 1,))
     
-    start_idx = st.session_state.current_page * page_size
-    end_idx = start_idx + page_size
-    return df.iloc[start_idx:end_idx]
+    return current_page
+
+@st.cache_data(ttl=600, show_spinner=False)
+def read_result_page(table: str, start: int, page_size: int) -> pd.DataFrame:
+    """Đọc một trang từ bảng kết quả tạm của query trên BigQuery (list_rows, chỉ tải đúng các dòng cần)"""
+    client = init_bigquery_client()
+    df = read_table_rows(table, start, page_size, client)
+    df.index = pd.RangeIndex(start, start + len(df))
+    return df
+
+def fetch_result_page(result: ResultHandle, page: int, page_size: int = RESULT_PAGE_SIZE) -> Optional[pd.DataFrame]:
+    """Một trang kết quả: đọc từ result store, nếu kết quả đã bị xóa khỏi store thì đọc từ bảng kết quả của query"""
+    start = page * page_size
+    df = get_result_store().to_pandas(result, start, start + page_size)
+    if df is None and result.attrs.get("destination"):
+        try:
+            df = read_result_page(result.attrs["destination"], start, page_size)
+        except Exception as e:
+            logger.warning("Không đọc được trang %s của %s: %s", page, result.attrs["destination"], e)
+    return df
+
+@st.cache_resource
+def get_result_store() -> SessionResultStore:
+    """Kết quả query của mọi session dạng Arrow; session_state chỉ giữ handle"""
+    store = SessionResultStore()
+
+    def collect():
+        stats = store.stats()
+        return [({"location": "memory"}, stats["memory_bytes"]), ({"location": "spilled"}, stats["spilled_bytes"])]
+
+    get_metrics_registry().register_gauge(
+        "result_store_bytes", collect, "Dung lượng kết quả query của các session (trong RAM / file memory-map)"
+    )
+    return store
+
+def get_query_result() -> Optional[ResultHandle]:
+    """Handle kết quả query của session; None nếu chưa có hoặc đã bị xóa do session lâu không hoạt động"""
+    result = st.session_state.get("query_result")
+    # Kết quả đã bị xóa khỏi store nhưng còn bảng kết quả trên BigQuery thì vẫn xem từng trang được
+    if result is not None and get_result_store().get_table(result) is None and not result.attrs.get("destination"):
+        del st.session_state.query_result
+        st.info("⌛ Kết quả query đã bị xóa do lâu không sử dụng, vui lòng thực thi lại")
+        return None
+    return result
+
+@st.cache_resource
+def get_sync_job_manager() -> SyncJobManager:
+    """Job manager dùng chung cho toàn bộ process (mọi session)"""
+    return SyncJobManager()
+
+@st.cache_resource
+def get_sync_checkpoint_store() -> SyncCheckpointStore:
+    """Checkpoint store dùng chung cho toàn bộ process"""
+    return SyncCheckpointStore()
+
+def format_bytes(num_bytes: float) -> str:
+    """Hiển thị dung lượng dạng dễ đọc"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+def show_query_estimate(estimate: Dict):
+    """Hiển thị kết quả dry-run của query"""
+    if estimate.get("error"):
+        st.error(f"❌ Query không hợp lệ: {estimate['error']}")
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("📦 Dữ liệu xử lý", format_bytes(estimate["bytes_processed"]))
+    with col2:
+        st.metric("💵 Chi phí ước tính", f"${estimate['estimated_cost']:.4f}")
+    with col3:
+        st.metric("♻️ Cache BigQuery", "Có thể" if estimate["cache_eligible"] else "Không")
+    
+    if estimate["referenced_tables"]:
+        st.caption("📋 Bảng: " + ", ".join(f"`{table}`" for table in estimate["referenced_tables"]))
+    
+    if estimate["within_budget"]:
+        st.success(f"✅ Trong ngân sách {format_bytes(estimate['max_bytes_billed'])}")
+    else:
+        st.error(
+            f"❌ Query cần xử lý {format_bytes(estimate['bytes_processed'])}, vượt ngân sách "
+            f"{format_bytes(estimate['max_bytes_billed'])}. Hãy thu hẹp cột/điều kiện lọc hoặc dùng bảng partition."
+        )
+
+def show_diagnostics():
+    """Thời gian theo phase và độ trễ request Larkbase (dùng chung mọi session trên instance)"""
+    metrics = get_metrics_registry()
+    phases = metrics.histogram_summary("phase_duration_seconds")
+    if not phases:
+        return
+
+    rows = {r["phase"]: r["value"] for r in metrics.counter_values("phase_rows_total")}
+    sizes = {r["phase"]: r["value"] for r in metrics.counter_values("phase_bytes_total")}
+    with st.expander("🩺 Chẩn đoán hiệu năng"):
+        st.dataframe(pd.DataFrame([{
+            "Phase": p["phase"],
+            "Trạng thái": p["status"],
+            "Số lần": p["count"],
+            "Tổng (s)": round(p["sum"], 2),
+            "p50 (s)": round(p["p50"], 3),
+            "p99 (s)": round(p["p99"], 3),
+            "Số dòng": int(rows.get(p["phase"], 0)),
+            "Dung lượng": format_bytes(sizes.get(p["phase"], 0))
+        } for p in sorted(phases, key=lambda p: p["phase"])]), use_container_width=True, hide_index=True)
+
+        requests_summary = metrics.histogram_summary("larkbase_request_duration_seconds")
+        if requests_summary:
+            retries: Dict[str, int] = {}
+            for r in metrics.counter_values("larkbase_request_retries_total"):
+                retries[r["endpoint"]] = retries.get(r["endpoint"], 0) + int(r["value"])
+            st.markdown("**Request Larkbase**")
+            st.dataframe(pd.DataFrame([{
+                "Endpoint": r["endpoint"],
+                "Method": r["method"],
+                "HTTP": r["status"],
+                "Số request": r["count"],
+                "p50 (s)": round(r["p50"], 3),
+                "p99 (s)": round(r["p99"], 3),
+                "Retry": retries.get(r["endpoint"], 0)
+            } for r in requests_summary]), use_container_width=True, hide_index=True)
+
+def show_query_result(result: ResultHandle):
+    """Thông tin và trang hiện tại của kết quả query (mỗi lần chạy script chỉ đọc một trang)"""
+    if result.attrs.get("cache_hit"):
+        st.caption("⚡ Kết quả được đọc từ cache")
+    
+    # Metrics
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("📊 Dòng", f"{result.num_rows:,}")
+    with col2:
+        st.metric("📋 Cột", len(result.columns))
+    with col3:
+        st.metric("💾 MB", f"{result.nbytes / 1024**2:.1f}")
+    with col4:
+        st.metric("📄 Trang", f"{result.page_count(RESULT_PAGE_SIZE):,}")
+    
+    # Data display
+    st.markdown("**📋 Kết quả:**")
+    page = paginate_result(result)
+    page_data = fetch_result_page(result, page)
+    if page_data is None:
+        st.warning("⚠️ Không đọc được dữ liệu của trang này, vui lòng thực thi lại query")
+    else:
+        st.dataframe(page_data, use_container_width=True, height=350)
+
+def show_export_options(result: ResultHandle):
+    """Tải kết quả về: file chỉ được tạo khi người dùng yêu cầu và được giữ lại cho các lần tải sau"""
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        export_format = st.selectbox(
+            "Định dạng tải về:",
+            list(EXPORT_FORMATS),
+            format_func=lambda f: EXPORT_FORMATS[f]["label"],
+            key="export_format",
+            label_visibility="collapsed"
+        )
+    with col2:
+        prepare = st.button("📦 Tạo file tải về", use_container_width=True)
+    
+    ready = st.session_state.get("export_ready")
+    if prepare:
+        with st.spinner("📦 Đang tạo file..."):
+            path = export_result(get_result_store(), result, export_format, metrics=get_metrics_registry())
+        if path is None:
+            st.error("❌ Kết quả query đã bị xóa, vui lòng thực thi lại")
+            return
+        ready = st.session_state.export_ready = {"result_id": result.result_id, "format": export_format, "path": path}
+    
+    # Nút tải chỉ hiện sau khi bấm tạo file, để các lần chạy lại script khác không phải đọc lại file
+    if ready and ready["result_id"] == result.result_id and ready["format"] == export_format \
+            and os.path.exists(ready["path"]):
+        info = EXPORT_FORMATS[export_format]
+        with col3:
+            with open(ready["path"], "rb") as f:
+                st.download_button(
+                    f"📥 {info['label']} ({format_bytes(os.path.getsize(ready['path']))})",
+                    f,
+                    f"data_{pd.Timestamp.now().strftime('%H%M%S')}.{info['extension']}",
+                    info["mime"],
+                    use_container_width=True,
+                    on_click=lambda: st.session_state.pop("export_ready", None)
+                )
+
+BATCH_ACTIONS = {"create": "Tạo mới", "update": "Cập nhật"}
+
+def show_batch_results(results: List[Dict], total_records: int):
+    """Hiển thị kết quả ghi dữ liệu theo batch"""
+    results = [r for r in results if r.get("status") != "no_records"]
+    success_count = sum(1 for r in results if r.get("status") == "success")
+    error_count = len(results) - success_count
+    
+    if error_count == 0:
+        st.success(f"✅ Đã ghi thành công {total_records} bản ghi vào Larkbase!")
+    else:
+        st.warning(f"⚠️ Ghi hoàn tất: {success_count} thành công, {error_count} lỗi")
+        
+        # Hiển thị chi tiết lỗi
+        errors = [r for r in results if r.get("status") == "error"]
+        if errors:
+            with st.expander("Chi tiết lỗi"):
+                for error in errors:
+                    rows = error.get("rows")
+                    location = f"Dòng {rows[0] + 1:,}-{rows[1]:,}" if rows else f"Batch {error.get('batch')}"
+                    # Upsert: phân biệt batch tạo mới và batch cập nhật
+                    action = BATCH_ACTIONS.get(error.get("action"))
+                    if action:
+                        location = f"{action} {location.lower()}"
+                    st.error(f"{location}: {error.get('msg', error.get('exception'))}")
 
 def main():
     st.markdown("### 📊 BigQuery to Larkbase")
-    
-    # Kiểm tra kết nối BigQuery
-    client = init_bigquery_client()
-    if client is None:
-        st.error("❌ Không thể kết nối đến BigQuery")
-        st.stop()
+    record_first_paint()
+    start_metrics_server()
+    # BigQuery client và token Larkbase được chuẩn bị nền, chỉ chờ khi thật sự cần dùng
+    start_warmup()
     
     # Query section (giữ nguyên như cũ)
     col1, col2 = st.columns([4, 1])
@@ -372,6 +461,7 @@ def main():
     with col2:
         st.markdown("<br>", unsafe_allow_html=True)
         execute_button = st.button("🚀 Thực thi", type="primary", use_container_width=True)
+        estimate_button = st.button("🔎 Ước tính", use_container_width=True)
         
         if query.strip():
             is_valid, message = validate_query(query)
@@ -380,6 +470,31 @@ def main():
             else:
                 st.error("❌ Không hợp lệ")
     
+    # Tùy chọn xem trước: giới hạn số dòng và chỉ lấy các cột cần thiết (giảm bytes quét và tải về)
+    with st.expander("⚙️ Tùy chọn xem trước"):
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            preview_limit = st.number_input("Số dòng tối đa:", min_value=1, max_value=1_000_000, value=1000, step=1000)
+        with col2:
+            known_columns = st.session_state.get("query_schema", {}).get(normalize_query(query), [])
+            preview_columns = st.multiselect(
+                "Chỉ lấy các cột:",
+                known_columns,
+                help="Danh sách cột có sau khi bấm Ước tính; để trống để lấy tất cả cột"
+            )
+    
+    # Ước tính chi phí (dry-run) mà không thực thi query
+    if estimate_button and query.strip() and not execute_button:
+        is_valid, message = validate_query(query)
+        if not is_valid:
+            st.error(f"❌ {message}")
+            return
+        with st.spinner("🔎 Đang ước tính..."):
+            estimate = estimate_query(query, preview_limit, preview_columns)
+        if not preview_columns and estimate.get("schema"):
+            st.session_state.setdefault("query_schema", {})[normalize_query(query)] = estimate["schema"]
+        show_query_estimate(estimate)
+    
     # Execute query (giữ nguyên như cũ)
     if execute_button and query.strip():
         is_valid, message = validate_query(query)
@@ -387,58 +502,36 @@ def main():
             st.error(f"❌ {message}")
             return
         
+        # Dry-run trước để chặn query vượt ngân sách (bỏ qua nếu kết quả đã có trong cache)
+        if not get_query_cache().contains(query, preview_limit, preview_columns):
+            with st.spinner("🔎 Đang ước tính..."):
+                estimate = estimate_query(query, preview_limit, preview_columns)
+            if estimate.get("error") or not estimate["within_budget"]:
+                show_query_estimate(estimate)
+                return
+        
         with st.spinner("🔄 Đang truy vấn..."):
-            df = run_bigquery_query(query)
+            df = run_bigquery_query(query, preview_limit, preview_columns)
             
             if df is not None and not df.empty:
+                # Session chỉ giữ handle, dữ liệu được lưu dạng cột gọn trong result store
+                st.session_state.query_result = get_result_store().put(get_tab_id(), df)
                 st.session_state.current_page = 0
-                st.session_state.query_result = df
-                
-                # Metrics
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.metric("📊 Dòng", f"{len(df):,}")
-                with col2:
-                    st.metric("📋 Cột", len(df.columns))
-                with col3:
-                    memory_mb = df.memory_usage(deep=True).sum() / 1024**2
-                    st.metric("💾 MB", f"{memory_mb:.1f}")
-                with col4:
-                    st.metric("📄 Trang", math.ceil(len(df) / 10))
-                
-                # Data display
-                st.markdown("**📋 Kết quả:**")
-                page_data = paginate_dataframe(df, page_size=10)
-                st.dataframe(page_data, use_container_width=True, height=350)
-                
-                # Download options
-                col1, col2 = st.columns(2)
-                with col1:
-                    csv = df.to_csv(index=False)
-                    st.download_button(
-                        "📥 CSV",
-                        csv,
-                        f"data_{pd.Timestamp.now().strftime('%H%M%S')}.csv",
-                        "text/csv",
-                        use_container_width=True
-                    )
-                with col2:
-                    json_data = df.to_json(orient='records', indent=2)
-                    st.download_button(
-                        "📥 JSON", 
-                        json_data,
-                        f"data_{pd.Timestamp.now().strftime('%H%M%S')}.json",
-                        "application/json",
-                        use_container_width=True
-                    )
-                
+                st.session_state.last_query = query
+                st.session_state.last_query_columns = preview_columns
             elif df is not None:
                 st.warning("⚠️ Query không trả về dữ liệu")
             else:
                 st.error("❌ Lỗi thực thi query")
     
+    # Kết quả được hiển thị từ session state nên vẫn còn khi chuyển trang hoặc thao tác khác
+    result = get_query_result()
+    if result is not None and result.num_rows:
+        show_query_result(result)
+        show_export_options(result)
+    
     # Larkbase section với tùy chọn xóa dữ liệu cũ
-    if 'query_result' in st.session_state and not st.session_state.query_result.empty:
+    if result is not None and result.num_rows:
         st.markdown('<div class="larkbase-section">', unsafe_allow_html=True)
         st.markdown("### 📝 Ghi dữ liệu vào Larkbase")
         
@@ -456,71 +549,266 @@ def main():
                 help="ID của bảng trong Larkbase"
             )
         
-        # Tùy chọn xóa dữ liệu cũ
-        clear_old_data = st.checkbox(
-            "🗑️ Xóa tất cả dữ liệu cũ trước khi ghi mới",
-            value=True,
-            help="Nếu chọn, sẽ xóa toàn bộ dữ liệu hiện có trong bảng trước khi ghi dữ liệu mới"
-        )
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            # Chế độ ghi: xóa hết rồi ghi lại, chỉ thêm mới, hoặc đồng bộ theo khóa
+            sync_mode = st.radio(
+                "Chế độ ghi:",
+                list(SYNC_MODES.keys()),
+                format_func=SYNC_MODES.get,
+                help="Đồng bộ theo khóa chỉ tạo/cập nhật/xóa những bản ghi thực sự thay đổi"
+            )
+        with col2:
+            max_concurrent_batches = st.number_input(
+                "Số batch song song:",
+                min_value=1,
+                max_value=16,
+                # LARKBASE_MAX_CONCURRENT_BATCHES có thể lớn hơn max_value (Streamlit báo lỗi nếu value vượt giới hạn)
+                value=min(LarkbaseConfig().max_concurrent_batches, 16),
+                help="Số batch được gửi đồng thời khi ghi dữ liệu vào Larkbase"
+            )
+        
+        stream_from_bigquery = st.checkbox(
+            "⚡ Streaming trực tiếp từ BigQuery (toàn bộ kết quả, không giới hạn số dòng xem trước)",
+            value=False,
+            disabled=sync_mode == "upsert",
+            help="Chạy lại query và ghi từng trang kết quả vào Larkbase trong lúc tải trang tiếp theo, "
+                 "không giữ toàn bộ kết quả trong bộ nhớ"
+        ) and sync_mode != "upsert"
+        
+        key_columns, delete_missing = [], True
+        if sync_mode == "upsert":
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                key_columns = st.multiselect(
+                    "Cột khóa:",
+                    result.columns,
+                    help="Các cột dùng để xác định một bản ghi trong Larkbase"
+                )
+            with col2:
+                delete_missing = st.checkbox(
+                    "Xóa bản ghi không còn trong kết quả",
+                    value=True
+                )
         
         if st.button("📤 Ghi vào Larkbase", type="secondary", use_container_width=True):
             if not app_token or not table_id:
                 st.error("❌ Vui lòng nhập đầy đủ App Token và Table ID")
                 return
+            if sync_mode == "upsert" and not key_columns:
+                st.error("❌ Vui lòng chọn ít nhất một cột khóa")
+                return
             
             # Khởi tạo Larkbase
-            config = LarkbaseConfig()
-            authenticator = LarkbaseAuthenticator(config)
+            config = LarkbaseConfig(max_concurrent_batches=max_concurrent_batches)
+            authenticator = LarkbaseAuthenticator(config, get_larkbase_http_client(), get_larkbase_token_cache())
             
             with st.spinner("🔐 Đang xác thực Larkbase..."):
                 access_token = authenticator.authenticate()
             
             if access_token:
-                st.success("✅ Xác thực Larkbase thành công")
-                record_manager = LarkbaseRecordManager(access_token, config)
-                
-                # Xóa dữ liệu cũ nếu được chọn
-                if clear_old_data:
-                    with st.spinner("🗑️ Đang lấy danh sách records cũ..."):
-                        old_record_ids = record_manager.get_all_records(app_token, table_id)
-                    
-                    if old_record_ids:
-                        st.info(f"📋 Tìm thấy {len(old_record_ids)} bản ghi cũ")
-                        with st.spinner("🗑️ Đang xóa dữ liệu cũ..."):
-                            delete_result = record_manager.batch_delete_records(old_record_ids, app_token, table_id)
-                        
-                        if delete_result.get("error_batches", 0) == 0:
-                            st.success(f"✅ Đã xóa thành công {len(old_record_ids)} bản ghi cũ")
-                        else:
-                            st.warning(f"⚠️ Xóa hoàn tất với {delete_result.get('error_batches', 0)} lỗi")
-                    else:
-                        st.info("📋 Không có dữ liệu cũ để xóa")
-                
-                # Ghi dữ liệu mới
-                records = st.session_state.query_result.to_dict('records')
-                
-                with st.spinner("📝 Đang ghi dữ liệu mới vào Larkbase..."):
-                    results = record_manager.batch_create_records(records, app_token, table_id)
-                
-                # Hiển thị kết quả
-                success_count = sum(1 for r in results if r.get("status") == "success")
-                error_count = len(results) - success_count
+                record_manager = LarkbaseRecordManager(access_token, config, authenticator.http, authenticator,
+                                                       owner=get_session_id())
+                stream_sql = None
+                if stream_from_bigquery:
+                    stream_sql = build_query_sql(
+                        st.session_state.last_query, None, st.session_state.get("last_query_columns")
+                    )
                 
-                if error_count == 0:
-                    st.success(f"✅ Đã ghi thành công {len(records)} bản ghi vào Larkbase!")
-                else:
-                    st.warning(f"⚠️ Ghi hoàn tất: {success_count} thành công, {error_count} lỗi")
-                    
-                    # Hiển thị chi tiết lỗi
-                    errors = [r for r in results if r.get("status") == "error"]
-                    if errors:
-                        with st.expander("Chi tiết lỗi"):
-                            for error in errors:
-                                st.error(f"Batch {error.get('batch')}: {error.get('msg', error.get('exception'))}")
+                # Chạy đồng bộ trong thread nền để không bị dừng khi script chạy lại
+                df = None if stream_sql else get_result_store().to_pandas(result)
+                if df is None and not stream_sql:
+                    st.error("❌ Kết quả query đã bị xóa, vui lòng thực thi lại")
+                    return
+                job = SyncJob(f"{SYNC_MODES[sync_mode]} → {table_id}", owner=get_session_id())
+                params = {
+                    "description": job.description,
+                    "query": st.session_state.last_query,
+                    "columns": st.session_state.get("last_query_columns"),
+                    "app_token": app_token,
+                    "table_id": table_id,
+                    "sync_mode": sync_mode,
+                    "stream_sql": stream_sql,
+                    "key_columns": key_columns,
+                    "delete_missing": delete_missing,
+                    "max_concurrent_batches": max_concurrent_batches
+                }
+                # Lưu checkpoint (kèm ảnh chụp kết quả) để có thể tiếp tục nếu job lỗi giữa chừng
+                checkpoint = get_sync_checkpoint_store().create(job.job_id, params, None if stream_sql else df,
+                                                                owner=job.owner)
+                submit_sync_job(job, record_manager, params, df, checkpoint,
+                                init_bigquery_client() if stream_sql else None)
+                st.success(f"✅ Đã tạo job đồng bộ `{job.job_id}`")
             else:
-                st.error("❌ Không thể xác thực với Larkbase")
+                st.error(f"❌ Không thể xác thực với Larkbase: {authenticator.last_error}")
         
         st.markdown('</div>', unsafe_allow_html=True)
 
+# Khóa ký sid trên URL; đặt cùng SESSION_SECRET cho mọi instance để sid còn hợp lệ sau khi khởi động lại
+SESSION_SECRET = os.getenv('SESSION_SECRET') or secrets.token_hex(32)
+
+def _sign_session_id(session_id: str) -> str:
+    return hmac.new(SESSION_SECRET.encode('utf-8'), session_id.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+def get_session_id() -> str:
+    """ID người dùng, dùng để lọc job/checkpoint. ID do server tạo và lưu trên URL dạng <id>.<chữ ký> để còn
+    sau khi tải lại trang; sid không có chữ ký hợp lệ (tự đặt hoặc sửa tay) bị bỏ qua và thay bằng ID mới"""
+    if "session_id" not in st.session_state:
+        params = st.experimental_get_query_params()
+        session_id, _, signature = (params.get("sid") or [""])[0].partition(".")
+        if not session_id or not hmac.compare_digest(signature, _sign_session_id(session_id)):
+            session_id = uuid.uuid4().hex
+            st.experimental_set_query_params(**{**params, "sid": f"{session_id}.{_sign_session_id(session_id)}"})
+        st.session_state.session_id = session_id
+    return st.session_state.session_id
+
+def get_tab_id() -> str:
+    """ID của tab hiện tại, chỉ nằm trong session_state (không lấy từ URL): kết quả query thuộc về từng tab,
+    nên hai tab cùng URL không thay kết quả của nhau trong result store"""
+    if "tab_id" not in st.session_state:
+        st.session_state.tab_id = uuid.uuid4().hex
+    return st.session_state.tab_id
+
+# Chu kỳ cập nhật tiến độ job (giây)
+SYNC_POLL_INTERVAL = float(os.getenv('SYNC_POLL_INTERVAL', 1.5))
+
+JOB_STATUS_ICONS = {
+    "queued": "⏳",
+    "running": "🔄",
+    "succeeded": "✅",
+    "failed": "❌",
+    "cancelled": "⛔"
+}
+
+def submit_sync_job(job: SyncJob, record_manager: LarkbaseRecordManager, params: Dict,
+                    df: Optional[pd.DataFrame], checkpoint: Optional[SyncCheckpoint], client) -> SyncJob:
+    """Đưa một lần đồng bộ (mới hoặc tiếp tục từ checkpoint) vào job manager"""
+    return get_sync_job_manager().submit(job, lambda job: run_larkbase_sync(
+        job, record_manager, params["app_token"], params["table_id"], params["sync_mode"], df=df,
+        stream_sql=params.get("stream_sql"), key_columns=params.get("key_columns"),
+        delete_missing=params.get("delete_missing", True), bigquery_client=client, checkpoint=checkpoint
+    ))
+
+def show_resumable_checkpoints():
+    """Hiển thị các job chưa hoàn tất của người dùng hiện tại có thể tiếp tục từ checkpoint"""
+    manager = get_sync_job_manager()
+    checkpoints = [
+        checkpoint for checkpoint in get_sync_checkpoint_store().list_incomplete(owner=get_session_id())
+        if not (manager.get(checkpoint.job_id) and not manager.get(checkpoint.job_id).is_finished)
+    ]
+    if not checkpoints:
+        return
+    
+    with st.expander(f"♻️ Job chưa hoàn tất ({len(checkpoints)})"):
+        for checkpoint in checkpoints:
+            params = checkpoint.meta["params"]
+            col1, col2, col3 = st.columns([4, 1, 1])
+            with col1:
+                st.markdown(f"`{checkpoint.job_id}` {params['description']}")
+                st.caption(
+                    f"{checkpoint.meta.get('status')} - đã ghi {checkpoint.completed_row_count:,} dòng"
+                    + (f" - {checkpoint.meta['error']}" if checkpoint.meta.get("error") else "")
+                )
+            with col2:
+                can_resume = bool(params.get("stream_sql")) or os.path.exists(checkpoint.snapshot_path)
+                resume = st.button("▶️ Tiếp tục", key=f"resume_{checkpoint.job_id}", disabled=not can_resume,
+                                   help=None if can_resume else "Không có ảnh chụp dữ liệu để tiếp tục")
+            with col3:
+                if st.button("🗑️ Bỏ", key=f"discard_{checkpoint.job_id}"):
+                    get_sync_checkpoint_store().delete(checkpoint.job_id)
+                    st.rerun()
+            
+            if resume:
+                config = LarkbaseConfig(max_concurrent_batches=params.get("max_concurrent_batches"))
+                authenticator = LarkbaseAuthenticator(config, get_larkbase_http_client(),
+                                                      get_larkbase_token_cache())
+                access_token = authenticator.authenticate()
+                if not access_token:
+                    st.error(f"❌ Không thể xác thực với Larkbase: {authenticator.last_error}")
+                    return
+                record_manager = LarkbaseRecordManager(access_token, config, authenticator.http, authenticator,
+                                                       owner=get_session_id())
+                job = SyncJob(params["description"], owner=get_session_id(), job_id=checkpoint.job_id)
+                client = init_bigquery_client() if params.get("stream_sql") else None
+                submit_sync_job(job, record_manager, params, checkpoint.load_snapshot(), checkpoint, client)
+                st.rerun()
+
+def show_sync_summary(summary: Dict):
+    """Hiển thị kết quả của một job đồng bộ"""
+    cleared = summary.get("cleared")
+    upsert = summary.get("upsert")
+    if upsert:
+        st.info(
+            f"📋 {upsert['existing']} bản ghi hiện có: {upsert['created']} tạo mới, "
+            f"{upsert['updated']} cập nhật, {upsert['deleted']} xóa, {upsert['unchanged']} không đổi"
+        )
+        if cleared and cleared.get("error_batches", 0):
+            st.warning(f"⚠️ Xóa hoàn tất với {cleared.get('error_batches', 0)} lỗi")
+    elif cleared is not None:
+        if cleared["total_records"] == 0:
+            st.info("📋 Không có dữ liệu cũ để xóa")
+        elif cleared["error_batches"] == 0:
+            st.success(f"✅ Đã xóa thành công {cleared['deleted_records']} bản ghi cũ")
+        else:
+            st.warning(f"⚠️ Xóa hoàn tất với {cleared['error_batches']} lỗi")
+    
+    if summary.get("skipped_rows"):
+        st.caption(f"♻️ Bỏ qua {summary['skipped_rows']:,} dòng đã ghi ở lần chạy trước")
+    show_batch_results(summary["results"], summary["written_count"])
+
+def show_rate_governor_stats():
+    """Hàng đợi và thời gian chờ của rate governor Larkbase (dùng chung mọi session)"""
+    stats = get_larkbase_rate_governor().stats()
+    if not stats:
+        return
+    with st.expander("🚦 Giới hạn tần suất Larkbase"):
+        st.dataframe(pd.DataFrame([{
+            "Endpoint": s["endpoint"],
+            "QPS": s["qps"],
+            "Đang chờ": s["queue_depth"],
+            "Session chờ": s["waiting_owners"],
+            "Đã gửi": s["granted"],
+            "Bị throttle": s["throttled"],
+            "Chờ TB (s)": round(s["avg_wait"], 3),
+            "Chờ tối đa (s)": round(s["max_wait"], 3)
+        } for s in stats]), use_container_width=True, hide_index=True)
+
+def show_sync_jobs():
+    """Hiển thị các job đồng bộ của session; tự làm mới khi còn job đang chạy"""
+    manager = get_sync_job_manager()
+    jobs = manager.list_jobs(owner=get_session_id())
+    if not jobs:
+        return
+    
+    st.markdown("### 🔄 Job đồng bộ")
+    for job in jobs:
+        icon = JOB_STATUS_ICONS.get(job.status, "")
+        with st.expander(f"{icon} `{job.job_id}` {job.description}", expanded=not job.is_finished):
+            if not job.is_finished:
+                st.progress(job.progress)
+                st.caption(f"{job.phase} - {job.message}" if job.message else job.phase or "Đang chờ...")
+                if job.cancel_requested:
+                    st.caption("⛔ Đang hủy...")
+                elif st.button("⛔ Hủy", key=f"cancel_{job.job_id}"):
+                    job.cancel()
+                    st.rerun()
+            elif job.status == "succeeded":
+                st.caption(f"⏱️ {job.finished_at - job.started_at:.1f}s")
+                show_sync_summary(job.result)
+            elif job.status == "failed":
+                st.error(f"❌ {job.error}")
+            else:
+                st.warning(f"⛔ Job đã bị hủy ({job.phase})")
+    
+    show_rate_governor_stats()
+
+    # Poll tiến độ: chạy lại script sau một khoảng ngắn khi còn job chưa xong
+    if any(not job.is_finished for job in jobs):
+        time.sleep(SYNC_POLL_INTERVAL)
+        st.rerun()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
+    show_resumable_checkpoints()
+    show_diagnostics()
+    show_sync_jobs()
\ No newline at end of file
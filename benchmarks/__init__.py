@@ -0,0 +1 @@
+"""Benchmark luồng đồng bộ BigQuery → Larkbase (xem benchmarks/bench_sync.py)"""
@@ -0,0 +1,99 @@
+"""Kiểm tra số request khi chia đôi batch ghi lỗi, chạy với Larkbase giả lập.
+
+Ví dụ:
+    python -m benchmarks.bench_bisect
+    python -m benchmarks.bench_bisect --rows 128 --workers 1
+
+Mỗi kịch bản gửi một batch gồm toàn bộ số dòng tới batch_create và đếm số request ghi mà server nhận được:
+một dòng dữ liệu lỗi được chia đôi tới tận dòng đó (2·log2(rows) + 1 request), mã lỗi 4xx chưa biết chỉ chia
+một lần rồi dừng vì hai nửa lỗi cùng mã (3 request), lỗi cấp bảng và lỗi 500 không chia (1 request), còn 413
+chia tới khi body vừa giới hạn. Thoát với mã 1 nếu số request hoặc số dòng lỗi khác kỳ vọng."""
+import argparse
+import json
+import logging
+import math
+import sys
+from typing import Dict, List, Optional
+
+from benchmarks.bench_sync import APP_TOKEN, TABLE_ID, build_record_manager
+from benchmarks.fixtures import larkbase_schema, synthetic_dataframe
+from benchmarks.stub_larkbase import StubConfig, StubLarkbaseServer
+from larkbase import LarkbaseRecordFormatter, no_progress
+
+UNKNOWN_ERROR_CODE = 1254999      # mã 4xx không có trong danh sách lỗi đã biết
+TABLE_ERROR_CODE = 1254045        # FieldNameNotFound: lỗi cấp bảng, chia đôi không giúp được
+
+def expected_cases(rows: int) -> List[Dict]:
+    """Các kịch bản kèm số request ghi và số dòng lỗi kỳ vọng cho một batch rows dòng (rows là lũy thừa của 2)"""
+    depth = int(math.log2(rows))
+    return [
+        {"name": "1 dòng dữ liệu lỗi", "bad_rows": 1, "stub": {},
+         "requests": 2 * depth + 1, "error_rows": 1},
+        {"name": "mã 4xx chưa biết", "bad_rows": 0, "stub": {"write_error": (400, UNKNOWN_ERROR_CODE)},
+         "requests": 3, "error_rows": rows},
+        {"name": "lỗi cấp bảng", "bad_rows": 0, "stub": {"write_error": (400, TABLE_ERROR_CODE)},
+         "requests": 1, "error_rows": rows},
+        {"name": "lỗi 500", "bad_rows": 0, "stub": {"error_rate": 1.0},
+         "requests": 1, "error_rows": rows},
+        # Giới hạn body ~3/4 cả batch: batch đầy bị 413, hai nửa vừa giới hạn
+        {"name": "413 body quá lớn", "bad_rows": 0, "stub": {"max_body_fraction": 0.75},
+         "requests": 3, "error_rows": 0},
+    ]
+
+def run_case(case: Dict, rows: int, args: argparse.Namespace) -> Dict:
+    df = synthetic_dataframe(rows, args.width, bad_rows=case["bad_rows"], seed=args.seed)
+    stub_options = dict(case["stub"])
+    max_body_fraction = stub_options.pop("max_body_fraction", None)
+    if max_body_fraction:
+        records = LarkbaseRecordFormatter(larkbase_schema(df)).format_dataframe(df)
+        body_bytes = len(json.dumps({"records": records}, ensure_ascii=False).encode("utf-8"))
+        stub_options["max_body_bytes"] = int(body_bytes * max_body_fraction)
+    stub_config = StubConfig(latency=args.latency, latency_jitter=0.0, seed=args.seed, **stub_options)
+
+    with StubLarkbaseServer(stub_config) as server:
+        server.create_table(APP_TOKEN, TABLE_ID, larkbase_schema(df))
+        manager = build_record_manager(server.api_endpoint, args.workers, None)
+        results = manager.batch_create_records(df, APP_TOKEN, TABLE_ID, batch_size=rows,
+                                               progress_callback=no_progress)
+        requests_sent = server.stats.by_endpoint.get("records/batch_create", 0)
+
+    errors = [r for r in results if r.get("status") == "error"]
+    error_rows = sum(r["rows"][1] - r["rows"][0] for r in errors if "rows" in r)
+    return {
+        "name": case["name"],
+        "requests": requests_sent,
+        "expected_requests": case["requests"],
+        "error_rows": error_rows,
+        "expected_error_rows": case["error_rows"],
+        "ok": requests_sent == case["requests"] and error_rows == case["error_rows"]
+    }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Kiểm tra số request khi chia đôi batch lỗi với server giả lập")
+    parser.add_argument("--rows", type=int, default=64, help="Số dòng của batch (lũy thừa của 2)")
+    parser.add_argument("--width", type=int, default=5, help="Số cột")
+    parser.add_argument("--workers", type=int, default=4, help="Số batch gửi song song")
+    parser.add_argument("--latency", type=float, default=0.01, help="Độ trễ mỗi request của server giả lập (giây)")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.rows < 2 or args.rows & (args.rows - 1):
+        print("--rows phải là lũy thừa của 2 (để số request kỳ vọng xác định)", file=sys.stderr)
+        return 2
+    logging.getLogger("bq2lark.metrics").setLevel(logging.WARNING)
+
+    header = f"{'kịch bản':<20} {'requests':>8} {'kỳ vọng':>8} {'dòng lỗi':>8} {'kỳ vọng':>8}"
+    print(header)
+    print("-" * len(header))
+    failed = 0
+    for case in expected_cases(args.rows):
+        result = run_case(case, args.rows, args)
+        failed += not result["ok"]
+        print(f"{result['name']:<20} {result['requests']:>8} {result['expected_requests']:>8} "
+              f"{result['error_rows']:>8} {result['expected_error_rows']:>8}{'' if result['ok'] else '  ✗'}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
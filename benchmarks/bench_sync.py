@@ -0,0 +1,185 @@
+"""Benchmark luồng đồng bộ BigQuery → Larkbase với Larkbase giả lập và BigQuery fixture cục bộ.
+
+Ví dụ:
+    python -m benchmarks.bench_sync --rows 1000,20000 --widths 5,30 --scenarios create,stream
+    python -m benchmarks.bench_sync --qps 20 --error-rate 0.02 --bad-rows 3 --output bench_results.jsonl
+
+Mỗi trường hợp in ra rows/giây, p50/p99 độ trễ batch và bộ nhớ đỉnh; --output ghi thêm một dòng JSON
+(kèm git revision) để so sánh kết quả giữa các lần thay đổi."""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fixtures import LocalBigQueryClient, larkbase_schema, synthetic_dataframe
+from benchmarks.stub_larkbase import StubConfig, StubLarkbaseServer
+
+from larkbase import (
+    LarkbaseAuthenticator, LarkbaseConfig, LarkbaseHttpClient, LarkbaseRateGovernor, LarkbaseRecordFormatter,
+    LarkbaseRecordManager, LarkbaseTokenCache, no_progress
+)
+from metrics import MetricsRegistry
+from sync import stream_query_to_larkbase
+
+SCENARIOS = ("create", "replace", "upsert", "stream")
+APP_TOKEN = "bench_app"
+TABLE_ID = "tbl_bench"
+
+def build_record_manager(api_endpoint: str, workers: int, client_qps: Optional[float]) -> LarkbaseRecordManager:
+    """Record manager trỏ tới server giả lập, dùng HTTP client/token cache/metrics riêng cho benchmark"""
+    config = LarkbaseConfig(app_id="cli_bench", app_secret="bench", api_endpoint=api_endpoint,
+                            max_concurrent_batches=workers)
+    governor = LarkbaseRateGovernor(default_qps=client_qps, limits={}) if client_qps else None
+    http = LarkbaseHttpClient(governor=governor, metrics=MetricsRegistry())
+    authenticator = LarkbaseAuthenticator(config, http, LarkbaseTokenCache())
+    token = authenticator.authenticate()
+    if not token:
+        raise RuntimeError(f"Không xác thực được với server giả lập: {authenticator.last_error}")
+    return LarkbaseRecordManager(token, config, http=http, authenticator=authenticator, owner="bench")
+
+def run_case(scenario: str, rows: int, width: int, args: argparse.Namespace) -> Dict:
+    df = synthetic_dataframe(rows, width, bad_rows=args.bad_rows, seed=args.seed)
+    stub_config = StubConfig(latency=args.latency, latency_jitter=args.jitter, per_record_latency=args.per_record_latency,
+                             qps=args.qps, error_rate=args.error_rate, max_body_bytes=args.max_body_bytes,
+                             seed=args.seed)
+
+    with StubLarkbaseServer(stub_config) as server:
+        existing = []
+        if scenario == "replace":
+            # Bảng đã có đủ dữ liệu: xóa hết rồi ghi lại
+            existing = LarkbaseRecordFormatter(larkbase_schema(df)).format_dataframe(df)
+        elif scenario == "upsert":
+            # Bảng có 90% số dòng, 1/5 trong đó khác giá trị: ~10% tạo mới, ~18% cập nhật
+            existing = LarkbaseRecordFormatter(larkbase_schema(df)).format_dataframe(df)[: int(rows * 0.9)]
+            for record in existing[::5]:
+                record["fields"] = {**record["fields"], df.columns[1]: -1}
+        server.create_table(APP_TOKEN, TABLE_ID, larkbase_schema(df), existing)
+        manager = build_record_manager(server.api_endpoint, args.workers, args.client_qps)
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        started = time.perf_counter()
+        results: List[Dict] = []
+        if scenario == "create":
+            results = manager.batch_create_records(df, APP_TOKEN, TABLE_ID, progress_callback=no_progress)
+        elif scenario == "replace":
+            cleared = manager.clear_table(APP_TOKEN, TABLE_ID, progress_callback=no_progress)
+            results = cleared["results"] + manager.batch_create_records(df, APP_TOKEN, TABLE_ID,
+                                                                        progress_callback=no_progress)
+        elif scenario == "upsert":
+            summary = manager.sync_records_by_key(df, [df.columns[0]], APP_TOKEN, TABLE_ID,
+                                                  progress_callback=no_progress)
+            results = summary["create_results"] + summary["update_results"] + (
+                summary["delete_result"]["results"] if summary["delete_result"] else [])
+        else:
+            bigquery_client = LocalBigQueryClient(df, query_latency=args.bq_latency, page_latency=args.bq_page_latency)
+            results = stream_query_to_larkbase("SELECT * FROM fixture", manager, APP_TOKEN, TABLE_ID,
+                                               page_size=args.page_size, progress_callback=no_progress,
+                                               client=bigquery_client)["results"]
+        elapsed = time.perf_counter() - started
+        peak_bytes = None
+        if args.tracemalloc:
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        stub_stats = server.stats.to_dict()
+        final_records = server.record_count(APP_TOKEN, TABLE_ID)
+
+    latencies = np.array([r["latency"] for r in results if r.get("latency") is not None])
+    errors = [r for r in results if r.get("status") == "error"]
+    return {
+        "scenario": scenario,
+        "rows": rows,
+        "width": width,
+        "workers": args.workers,
+        "elapsed_seconds": round(elapsed, 4),
+        "rows_per_second": round(rows / elapsed, 1) if elapsed else None,
+        "batches": len(results),
+        "error_batches": len(errors),
+        "error_rows": sum(r["rows"][1] - r["rows"][0] for r in errors if "rows" in r),
+        "batch_latency_p50": round(float(np.percentile(latencies, 50)), 4) if len(latencies) else None,
+        "batch_latency_p99": round(float(np.percentile(latencies, 99)), 4) if len(latencies) else None,
+        "peak_memory_mb": round(peak_bytes / 2 ** 20, 2) if peak_bytes is not None else None,
+        "final_records": final_records,
+        "stub": stub_stats,
+        "stub_config": stub_config.to_dict()
+    }
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    def int_list(value: str) -> List[int]:
+        return [int(v) for v in value.split(",") if v]
+
+    parser = argparse.ArgumentParser(description="Benchmark đồng bộ BigQuery → Larkbase với server giả lập")
+    parser.add_argument("--scenarios", default="create,stream",
+                        help=f"Các kịch bản, phân tách bằng dấu phẩy: {', '.join(SCENARIOS)}")
+    parser.add_argument("--rows", type=int_list, default=[1000, 10000], help="Số dòng, ví dụ 1000,10000")
+    parser.add_argument("--widths", type=int_list, default=[10], help="Số cột, ví dụ 5,30")
+    parser.add_argument("--repeat", type=int, default=1, help="Số lần chạy lặp mỗi trường hợp")
+    parser.add_argument("--workers", type=int, default=4, help="Số batch gửi song song")
+    parser.add_argument("--client-qps", type=float, default=None, help="Bật rate governor phía client với QPS này")
+    parser.add_argument("--latency", type=float, default=0.05, help="Độ trễ mỗi request của server giả lập (giây)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Độ trễ ngẫu nhiên cộng thêm (giây)")
+    parser.add_argument("--per-record-latency", type=float, default=0.0, help="Độ trễ thêm mỗi record (giây)")
+    parser.add_argument("--qps", type=float, default=None, help="Giới hạn QPS mỗi endpoint của server giả lập")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Xác suất request ghi bị lỗi 500")
+    parser.add_argument("--bad-rows", type=int, default=0, help="Số dòng dữ liệu lỗi khiến batch bị từ chối")
+    parser.add_argument("--max-body-bytes", type=int, default=None, help="Body lớn hơn thì server trả về 413")
+    parser.add_argument("--page-size", type=int, default=5000, help="Số dòng mỗi trang BigQuery (kịch bản stream)")
+    parser.add_argument("--bq-latency", type=float, default=0.0, help="Thời gian chạy query giả lập (giây)")
+    parser.add_argument("--bq-page-latency", type=float, default=0.0, help="Thời gian tải mỗi trang giả lập (giây)")
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false",
+                        help="Không đo bộ nhớ đỉnh (tracemalloc làm chậm phần xử lý bằng Python)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="File JSON Lines để ghi thêm kết quả")
+    parser.add_argument("--verbose", action="store_true", help="In structured log của từng phase")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        print(f"Kịch bản không hợp lệ: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+    if not args.verbose:
+        logging.getLogger("bq2lark.metrics").setLevel(logging.WARNING)
+
+    revision = git_revision()
+    header = f"{'scenario':<8} {'rows':>8} {'width':>5} {'rows/s':>10} {'p50 (s)':>8} {'p99 (s)':>8} " \
+             f"{'peak MB':>8} {'errors':>6} {'requests':>8}"
+    print(header)
+    print("-" * len(header))
+    for scenario in scenarios:
+        for rows in args.rows:
+            for width in args.widths:
+                for _ in range(args.repeat):
+                    result = run_case(scenario, rows, width, args)
+                    print(f"{scenario:<8} {rows:>8} {width:>5} {result['rows_per_second'] or 0:>10,.0f} "
+                          f"{result['batch_latency_p50'] or 0:>8.3f} {result['batch_latency_p99'] or 0:>8.3f} "
+                          f"{result['peak_memory_mb'] if result['peak_memory_mb'] is not None else '-':>8} "
+                          f"{result['error_batches']:>6} {result['stub']['requests']:>8}")
+                    if args.output:
+                        result.update(timestamp=time.strftime("%Y-%m-%dT%H:%M:%S%z"), git_revision=revision)
+                        with open(args.output, "a") as f:
+                            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Dữ liệu tổng hợp và BigQuery client giả lập (đọc từ DataFrame trong bộ nhớ) cho benchmark"""
+import time
+import uuid
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.stub_larkbase import BAD_VALUE
+
+# Loại field Lark Bitable tương ứng với từng kiểu cột tổng hợp
+FIELD_TYPES = {"text": 1, "number": 2, "datetime": 5, "checkbox": 7}
+COLUMN_KINDS = ("text", "number", "datetime", "checkbox", "number", "text")
+
+def synthetic_dataframe(rows: int, width: int = 10, text_length: int = 24, null_rate: float = 0.05,
+                        bad_rows: int = 0, seed: int = 0) -> pd.DataFrame:
+    """DataFrame gồm các cột text/số/thời gian/boolean xen kẽ, có giá trị null;
+    bad_rows dòng đầu tiên được rải đều chứa BAD_VALUE để server giả lập từ chối batch"""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for i in range(width):
+        kind = COLUMN_KINDS[i % len(COLUMN_KINDS)]
+        name = f"{kind}_{i}"
+        if kind == "text":
+            alphabet = np.array(list("abcdefghijklmnopqrstuvwxyz0123456789 "))
+            chars = rng.choice(alphabet, size=(rows, text_length))
+            values = pd.Series(chars.view(f"<U{text_length}").ravel(), dtype=object)
+        elif kind == "number":
+            values = pd.Series(rng.normal(1000, 250, rows).round(2))
+        elif kind == "datetime":
+            values = pd.Series(pd.Timestamp("2024-01-01", tz="UTC")
+                               + pd.to_timedelta(rng.integers(0, 365 * 86400, rows), unit="s"))
+        else:
+            values = pd.Series(rng.random(rows) < 0.5)
+        if null_rate and kind != "checkbox":
+            values = values.mask(rng.random(rows) < null_rate)
+        columns[name] = values
+
+    df = pd.DataFrame(columns)
+    if bad_rows and width:
+        text_column = next((c for c in df.columns if c.startswith("text_")), None)
+        if text_column is not None:
+            positions = np.linspace(0, rows - 1, num=min(bad_rows, rows), dtype=int)
+            df.loc[positions, text_column] = BAD_VALUE
+    return df
+
+def larkbase_schema(df: pd.DataFrame) -> Dict[str, int]:
+    """Schema bảng Larkbase tương ứng với DataFrame tạo bởi synthetic_dataframe"""
+    return {column: FIELD_TYPES[column.split("_", 1)[0]] for column in df.columns}
+
+class _TableReference:
+    def __init__(self, project: str, dataset_id: str, table_id: str):
+        self.project = project
+        self.dataset_id = dataset_id
+        self.table_id = table_id
+
+class LocalRowIterator:
+    """Giả lập RowIterator: tổng số dòng và các trang DataFrame, mỗi trang có độ trễ tải"""
+
+    def __init__(self, df: pd.DataFrame, start_index: int = 0, page_size: Optional[int] = None,
+                 page_latency: float = 0.0):
+        self._df = df
+        self._start_index = start_index
+        self._page_size = page_size or 10000
+        self._page_latency = page_latency
+        self.total_rows = len(df)
+
+    def to_dataframe_iterable(self) -> Iterator[pd.DataFrame]:
+        for start in range(self._start_index, len(self._df), self._page_size):
+            if self._page_latency:
+                time.sleep(self._page_latency)
+            yield self._df.iloc[start:start + self._page_size].reset_index(drop=True)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return self._df.iloc[self._start_index:].reset_index(drop=True)
+
+class LocalQueryJob:
+    def __init__(self, client: "LocalBigQueryClient", df: pd.DataFrame, destination: _TableReference):
+        self._client = client
+        self._df = df
+        self.job_id = f"local_{uuid.uuid4().hex[:12]}"
+        self.destination = destination
+        self.total_bytes_processed = int(df.memory_usage(deep=True).sum())
+
+    def result(self, page_size: Optional[int] = None) -> LocalRowIterator:
+        if self._client.query_latency:
+            time.sleep(self._client.query_latency)
+        return LocalRowIterator(self._df, page_size=page_size, page_latency=self._client.page_latency)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return self.result().to_dataframe()
+
+class LocalBigQueryClient:
+    """Thay thế bigquery.Client trong benchmark: mọi query trả về cùng một DataFrame fixture.
+    Hỗ trợ những gì luồng đồng bộ dùng tới: query().result()/to_dataframe(), destination và list_rows()"""
+
+    def __init__(self, df: pd.DataFrame, query_latency: float = 0.0, page_latency: float = 0.0,
+                 project: str = "local"):
+        self.df = df
+        self.query_latency = query_latency
+        self.page_latency = page_latency
+        self.project = project
+        self.queries = []
+
+    def query(self, sql: str, job_config=None) -> LocalQueryJob:
+        self.queries.append(sql)
+        destination = _TableReference(self.project, "_local", f"anon_{len(self.queries)}")
+        return LocalQueryJob(self, self.df, destination)
+
+    def list_rows(self, table, start_index: int = 0, page_size: Optional[int] = None,
+                  max_results: Optional[int] = None) -> LocalRowIterator:
+        df = self.df if max_results is None else self.df.iloc[:start_index + max_results]
+        return LocalRowIterator(df, start_index=start_index, page_size=page_size, page_latency=self.page_latency)
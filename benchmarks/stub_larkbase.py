@@ -0,0 +1,278 @@
+"""Server HTTP giả lập các API Larkbase dùng cho benchmark (không cần mạng, không cần tài khoản Lark).
+
+Hỗ trợ: tenant_access_token, fields, records (list), records/batch_create, batch_update, batch_delete;
+kèm độ trễ, giới hạn tần suất (token bucket) và chèn lỗi có thể cấu hình."""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# Giá trị field khiến cả batch bị từ chối (giả lập một dòng dữ liệu lỗi)
+BAD_VALUE = "__bad__"
+
+RATE_LIMIT_CODE = 99991400
+INVALID_DATA_CODE = 1254060
+INTERNAL_ERROR_CODE = 1254290
+
+class StubConfig:
+    def __init__(self, latency: float = 0.05, latency_jitter: float = 0.02, per_record_latency: float = 0.0,
+                 qps: Optional[float] = None, error_rate: float = 0.0, max_body_bytes: Optional[int] = None,
+                 max_batch_records: int = 500, token_expire: int = 7200, seed: Optional[int] = None,
+                 write_error: Optional[Tuple[int, int]] = None):
+        self.latency = latency                        # độ trễ cố định mỗi request (giây)
+        self.latency_jitter = latency_jitter          # độ lệch ngẫu nhiên cộng thêm (giây)
+        self.per_record_latency = per_record_latency  # độ trễ thêm cho mỗi record trong batch ghi/xóa (giây)
+        self.qps = qps                                # giới hạn request/giây mỗi endpoint (None = không giới hạn)
+        self.error_rate = error_rate                  # xác suất một request ghi/xóa bị lỗi tạm thời
+        self.max_body_bytes = max_body_bytes          # body lớn hơn thì trả về 413
+        self.max_batch_records = max_batch_records
+        self.token_expire = token_expire
+        self.seed = seed
+        self.write_error = write_error                # (HTTP status, mã lỗi Lark) trả về cho mọi request ghi
+
+    def to_dict(self) -> Dict:
+        return dict(vars(self))
+
+class StubStats:
+    def __init__(self):
+        self.requests = 0
+        self.rate_limited = 0
+        self.injected_errors = 0
+        self.rejected_batches = 0
+        self.created = 0
+        self.deleted = 0
+        self.updated = 0
+        self.bytes_received = 0
+        self.by_endpoint: Dict[str, int] = {}
+
+    def to_dict(self) -> Dict:
+        return dict(vars(self))
+
+class _Bucket:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Lấy một token; trả về 0 nếu được phép, ngược lại số giây cần chờ"""
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class StubLarkbaseServer:
+    """Larkbase giả lập chạy trong thread nền; dữ liệu bảng giữ trong bộ nhớ theo (app_token, table_id)"""
+
+    _TABLE_PATH = re.compile(r'^/open-apis/bitable/v1/apps/([^/]+)/tables/([^/]+)/(fields|records)(?:/(\w+))?$')
+
+    def __init__(self, config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StubConfig()
+        self.stats = StubStats()
+        self.tables: Dict[Tuple[str, str], Dict[str, Dict]] = {}
+        self.schemas: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._buckets: Dict[str, _Bucket] = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(self.config.seed)
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/open-apis"
+
+    def start(self) -> "StubLarkbaseServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-larkbase", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubLarkbaseServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def create_table(self, app_token: str, table_id: str, fields: Optional[Dict[str, int]] = None,
+                     records: Optional[List[Dict]] = None):
+        """Tạo (hoặc làm mới) một bảng với schema tên field -> loại field và dữ liệu ban đầu"""
+        with self._lock:
+            self.schemas[(app_token, table_id)] = dict(fields or {})
+            self.tables[(app_token, table_id)] = {
+                self._new_record_id(): {"fields": record.get("fields", record)} for record in records or []
+            }
+
+    def record_count(self, app_token: str, table_id: str) -> int:
+        with self._lock:
+            return len(self.tables.get((app_token, table_id), {}))
+
+    @staticmethod
+    def _new_record_id() -> str:
+        return "rec" + uuid.uuid4().hex[:14]
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server._dispatch(self, "GET")
+
+            def do_POST(self):
+                server._dispatch(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _dispatch(self, handler: BaseHTTPRequestHandler, method: str):
+        parsed = urlparse(handler.path)
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+
+        match = self._TABLE_PATH.match(parsed.path)
+        endpoint = f"{match.group(3)}/{match.group(4)}" if match and match.group(4) else (
+            match.group(3) if match else parsed.path)
+        with self._lock:
+            self.stats.requests += 1
+            self.stats.bytes_received += len(body)
+            self.stats.by_endpoint[endpoint] = self.stats.by_endpoint.get(endpoint, 0) + 1
+
+        if self.config.qps:
+            with self._lock:
+                bucket = self._buckets.setdefault(endpoint, _Bucket(self.config.qps))
+                wait = bucket.take()
+            if wait:
+                with self._lock:
+                    self.stats.rate_limited += 1
+                self._send(handler, 429, {"code": RATE_LIMIT_CODE, "msg": "request trigger frequency limit"},
+                           {"x-ogw-ratelimit-reset": f"{wait:.3f}"})
+                return
+
+        time.sleep(max(0.0, self.config.latency + self._random.uniform(0, self.config.latency_jitter)))
+
+        if parsed.path.endswith("/auth/v3/tenant_access_token/internal") and method == "POST":
+            self._send(handler, 200, {"code": 0, "msg": "ok", "tenant_access_token": "t-" + uuid.uuid4().hex,
+                                      "expire": self.config.token_expire})
+            return
+        if not match:
+            self._send(handler, 404, {"code": 404, "msg": "not found"})
+            return
+
+        key = (match.group(1), match.group(2))
+        resource, action = match.group(3), match.group(4)
+        if resource == "fields" and method == "GET":
+            self._list_fields(handler, key)
+        elif resource == "records" and action is None and method == "GET":
+            self._list_records(handler, key, parse_qs(parsed.query))
+        elif resource == "records" and action in ("batch_create", "batch_update", "batch_delete") and method == "POST":
+            self._write_records(handler, key, action, body)
+        else:
+            self._send(handler, 404, {"code": 404, "msg": "not found"})
+
+    def _list_fields(self, handler, key):
+        items = [{"field_name": name, "type": field_type} for name, field_type in self.schemas.get(key, {}).items()]
+        self._send(handler, 200, {"code": 0, "data": {"items": items, "has_more": False, "page_token": None}})
+
+    def _list_records(self, handler, key, params: Dict[str, List[str]]):
+        page_size = min(int(params.get("page_size", ["100"])[0]), 500)
+        offset = int(params.get("page_token", ["0"])[0] or 0)
+        field_names = json.loads(params["field_names"][0]) if "field_names" in params else None
+        with self._lock:
+            record_ids = list(self.tables.get(key, {}))[offset:offset + page_size]
+            table = self.tables.get(key, {})
+            items = []
+            for record_id in record_ids:
+                fields = table[record_id]["fields"]
+                if field_names is not None:
+                    fields = {name: fields[name] for name in field_names if name in fields}
+                items.append({"record_id": record_id, "fields": fields})
+            has_more = offset + page_size < len(table)
+        self._send(handler, 200, {"code": 0, "data": {
+            "items": items, "has_more": has_more, "page_token": str(offset + page_size) if has_more else None,
+            "total": len(table)
+        }})
+
+    def _write_records(self, handler, key, action: str, body: bytes):
+        if self.config.max_body_bytes and len(body) > self.config.max_body_bytes:
+            self._send_raw(handler, 413, b"Request Entity Too Large", "text/plain")
+            return
+        try:
+            records = json.loads(body)["records"]
+        except (ValueError, KeyError):
+            self._send(handler, 400, {"code": 1254001, "msg": "WrongRequestBody"})
+            return
+        if len(records) > self.config.max_batch_records:
+            self._send(handler, 400, {"code": 1254104, "msg": "RecordsTooMany"})
+            return
+
+        if self.config.error_rate and self._random.random() < self.config.error_rate:
+            with self._lock:
+                self.stats.injected_errors += 1
+            self._send(handler, 500, {"code": INTERNAL_ERROR_CODE, "msg": "InternalError (injected)"})
+            return
+        if self.config.write_error:
+            with self._lock:
+                self.stats.rejected_batches += 1
+            status, code = self.config.write_error
+            self._send(handler, status, {"code": code, "msg": "WriteError (injected)"})
+            return
+        if action != "batch_delete" and any(BAD_VALUE in (r.get("fields") or {}).values() for r in records):
+            with self._lock:
+                self.stats.rejected_batches += 1
+            self._send(handler, 400, {"code": INVALID_DATA_CODE, "msg": "TextFieldConvFail (injected)"})
+            return
+
+        if self.config.per_record_latency:
+            time.sleep(self.config.per_record_latency * len(records))
+
+        with self._lock:
+            table = self.tables.setdefault(key, {})
+            if action == "batch_create":
+                result = []
+                for record in records:
+                    record_id = self._new_record_id()
+                    table[record_id] = {"fields": record.get("fields") or {}}
+                    result.append({"record_id": record_id, "fields": table[record_id]["fields"]})
+                self.stats.created += len(result)
+            elif action == "batch_update":
+                result = []
+                for record in records:
+                    if record.get("record_id") in table:
+                        table[record["record_id"]]["fields"].update(record.get("fields") or {})
+                        result.append({"record_id": record["record_id"], "fields": record.get("fields") or {}})
+                self.stats.updated += len(result)
+            else:
+                result = [{"record_id": record_id, "deleted": table.pop(record_id, None) is not None}
+                          for record_id in records]
+                self.stats.deleted += sum(1 for r in result if r["deleted"])
+        self._send(handler, 200, {"code": 0, "msg": "success", "data": {"records": result}})
+
+    def _send(self, handler, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        self._send_raw(handler, status, json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                       "application/json; charset=utf-8", headers)
+
+    @staticmethod
+    def _send_raw(handler, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
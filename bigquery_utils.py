@@ -0,0 +1,359 @@
+"""Thực thi query BigQuery: kiểm tra/chuẩn hóa SQL, dry-run ước tính chi phí, cache kết quả trên đĩa
+và đọc kết quả theo trang. Không phụ thuộc Streamlit"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+from metrics import MetricsRegistry, note_phase, track_phase
+
+# google-cloud-bigquery chỉ được import khi thật sự dùng tới (tạo client, chạy query):
+# import mất cỡ một giây nên không để chặn lần vẽ trang đầu tiên lúc cold start
+if TYPE_CHECKING:
+    from google.cloud import bigquery
+
+logger = logging.getLogger(__name__)
+
+# Ngân sách bytes cho mỗi query (mặc định 100MB), cấu hình theo từng deployment
+MAX_BYTES_BILLED = int(os.getenv('BQ_MAX_BYTES_BILLED', 100 * 1024 * 1024))
+# Giá on-demand (USD / TiB) dùng để ước tính chi phí
+PRICE_PER_TIB = float(os.getenv('BQ_PRICE_PER_TIB', 6.25))
+# Số dòng mỗi trang khi streaming kết quả BigQuery sang Larkbase
+STREAM_PAGE_SIZE = int(os.getenv('BQ_STREAM_PAGE_SIZE', 10000))
+
+def create_bigquery_client(service_account_info: Optional[Dict] = None) -> "bigquery.Client":
+    """Tạo BigQuery client từ service account (nếu có), ngược lại dùng Application Default Credentials
+    (Cloud Run, GOOGLE_APPLICATION_CREDENTIALS, gcloud auth)"""
+    from google.cloud import bigquery
+    if service_account_info:
+        from google.oauth2 import service_account
+        credentials = service_account.Credentials.from_service_account_info(service_account_info)
+        return bigquery.Client(credentials=credentials)
+    from google.auth import default
+    credentials, project = default()
+    return bigquery.Client(credentials=credentials, project=project)
+
+# Từ khóa SQL được chuẩn hóa chữ hoa khi tạo khóa cache (tên bảng/cột giữ nguyên vì có thể phân biệt hoa thường)
+SQL_KEYWORDS = {
+    'SELECT', 'FROM', 'WHERE', 'AND', 'OR', 'NOT', 'IN', 'IS', 'NULL', 'AS', 'ON', 'JOIN', 'LEFT', 'RIGHT',
+    'INNER', 'OUTER', 'FULL', 'CROSS', 'GROUP', 'BY', 'ORDER', 'HAVING', 'LIMIT', 'OFFSET', 'UNION', 'ALL',
+    'DISTINCT', 'WITH', 'CASE', 'WHEN', 'THEN', 'ELSE', 'END', 'ASC', 'DESC', 'BETWEEN', 'LIKE', 'EXCEPT',
+    'INTERSECT', 'QUALIFY', 'WINDOW', 'OVER', 'PARTITION', 'UNNEST', 'USING', 'TRUE', 'FALSE', 'CAST', 'EXISTS'
+}
+
+# Câu lệnh thay đổi dữ liệu/schema không được phép chạy từ dashboard
+DANGEROUS_KEYWORDS = {
+    'DELETE', 'DROP', 'TRUNCATE', 'INSERT', 'UPDATE', 'ALTER', 'CREATE', 'MERGE', 'GRANT', 'REVOKE',
+    'EXPORT', 'CALL', 'EXECUTE'
+}
+
+_SQL_TOKEN_PATTERN = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>(?:[rRbB]{1,2})?(?:'''.*?'''|\"\"\".*?\"\"\"|'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*"))
+  | (?P<quoted>`(?:[^`\\]|\\.)*`)
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z_0-9]*)
+  | (?P<param>@@?[A-Za-z_][A-Za-z_0-9]*)
+  | (?P<punct>.)
+""", re.S | re.X)
+
+class SqlToken(NamedTuple):
+    kind: str
+    value: str
+    start: int
+
+    @property
+    def keyword(self) -> Optional[str]:
+        """Từ khóa (chữ hoa) nếu token là word, ngược lại None"""
+        return self.value.upper() if self.kind == 'word' else None
+
+def tokenize_sql(query: str) -> List[SqlToken]:
+    """Tách query thành token: chuỗi, identifier trong backtick và comment không bị nhầm là từ khóa"""
+    return [SqlToken(m.lastgroup, m.group(), m.start()) for m in _SQL_TOKEN_PATTERN.finditer(query)]
+
+def _significant_tokens(query: str) -> List[SqlToken]:
+    """Token bỏ khoảng trắng và comment"""
+    return [token for token in tokenize_sql(query) if token.kind not in ('ws', 'comment')]
+
+def _split_statements(tokens: List[SqlToken]) -> List[List[SqlToken]]:
+    """Tách các câu lệnh theo dấu ; (bỏ câu lệnh rỗng)"""
+    statements, current = [], []
+    for token in tokens:
+        if token.kind == 'punct' and token.value == ';':
+            if current:
+                statements.append(current)
+            current = []
+        else:
+            current.append(token)
+    if current:
+        statements.append(current)
+    return statements
+
+def strip_query(query: str) -> str:
+    """Bỏ comment/khoảng trắng/dấu ; ở cuối query để có thể nối thêm mệnh đề"""
+    tokens = _significant_tokens(query)
+    while tokens and tokens[-1].kind == 'punct' and tokens[-1].value == ';':
+        tokens.pop()
+    if not tokens:
+        return ""
+    last = tokens[-1]
+    return query[tokens[0].start:last.start + len(last.value)]
+
+def normalize_query(query: str) -> str:
+    """Chuẩn hóa query (khoảng trắng, comment, chữ hoa từ khóa, dấu ; cuối) để các query tương đương dùng chung cache"""
+    tokens = _significant_tokens(strip_query(query))
+    normalized = []
+    for i, token in enumerate(tokens):
+        # Tên sau dấu . (ds.order, t.select) là identifier, giữ nguyên chữ hoa/thường
+        after_dot = i > 0 and tokens[i - 1].kind == 'punct' and tokens[i - 1].value == '.'
+        normalized.append(token.keyword if token.keyword in SQL_KEYWORDS and not after_dot else token.value)
+    return ' '.join(normalized)
+
+def has_outer_limit(query: str) -> bool:
+    """Kiểm tra query ngoài cùng đã có LIMIT (bỏ qua LIMIT trong subquery, chuỗi, comment)"""
+    depth = 0
+    for token in _significant_tokens(query):
+        if token.kind == 'punct' and token.value == '(':
+            depth += 1
+        elif token.kind == 'punct' and token.value == ')':
+            depth -= 1
+        elif depth == 0 and token.keyword == 'LIMIT':
+            return True
+    return False
+
+class QueryResultCache:
+    """Cache kết quả query trên đĩa dạng Parquet, dùng chung giữa các session, loại bỏ LRU theo tổng dung lượng"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None, ttl: Optional[int] = None):
+        # Trên Cloud Run, trỏ QUERY_CACHE_DIR tới volume được mount để cache còn sau cold start
+        self.cache_dir = cache_dir or os.getenv('QUERY_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'bq_query_cache'))
+        self.max_bytes = int(max_bytes or os.getenv('QUERY_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+        self.ttl = int(ttl or os.getenv('QUERY_CACHE_TTL', 3600))
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, query: str, limit, columns: Optional[List[str]] = None) -> str:
+        key_text = f"{normalize_query(query)}|{limit}|{','.join(columns or [])}"
+        key = hashlib.sha256(key_text.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def get(self, query: str, limit, columns: Optional[List[str]] = None,
+            ttl: Optional[int] = None) -> Optional[pd.DataFrame]:
+        """Đọc kết quả từ cache; mtime là thời điểm ghi (TTL), atime là lần đọc gần nhất (LRU)"""
+        path = self._path(query, limit, columns)
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > (self.ttl if ttl is None else ttl):
+                os.remove(path)
+                return None
+            df = pd.read_parquet(path)
+            os.utime(path, (time.time(), stat.st_mtime))
+            return df
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # File hỏng hoặc đang bị ghi đè: coi như cache miss
+            return None
+
+    def contains(self, query: str, limit, columns: Optional[List[str]] = None, ttl: Optional[int] = None) -> bool:
+        """Kiểm tra kết quả còn hạn trong cache mà không đọc dữ liệu"""
+        try:
+            age = time.time() - os.stat(self._path(query, limit, columns)).st_mtime
+        except FileNotFoundError:
+            return False
+        return age <= (self.ttl if ttl is None else ttl)
+
+    def put(self, query: str, limit, df: pd.DataFrame, columns: Optional[List[str]] = None):
+        """Ghi kết quả vào cache (ghi file tạm rồi rename để không đọc phải file dở dang)"""
+        path = self._path(query, limit, columns)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        except Exception:
+            # Một số kiểu dữ liệu không ghi được Parquet: bỏ qua cache cho query này
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """Xóa các file hết hạn, sau đó xóa file ít được dùng nhất cho tới khi dưới max_bytes"""
+        with self._lock:
+            entries = []
+            now = time.time()
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.parquet'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.ttl:
+                    self._remove(path)
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def build_query_sql(query: str, limit: Optional[int] = 1000, columns: Optional[List[str]] = None) -> str:
+    """Thêm LIMIT cho query ngoài cùng nếu chưa có (limit=None: không giới hạn); nếu chỉ cần một số cột thì
+    bọc query để BigQuery bỏ cột thừa"""
+    sql = strip_query(query)
+    if columns:
+        projection = ", ".join(f"`{column}`" for column in columns)
+        # Đặt ")" trên dòng riêng để comment cuối dòng trong query gốc không nuốt mất
+        sql = f"SELECT {projection}\nFROM (\n{sql}\n)"
+    if limit is not None and (columns or not has_outer_limit(sql)):
+        sql = f"{sql}\nLIMIT {limit}"
+    return sql
+
+# Hàm không xác định khiến BigQuery không dùng cache kết quả
+_NON_CACHEABLE_PATTERN = re.compile(
+    r'\b(CURRENT_(DATE|TIME|TIMESTAMP|DATETIME|USER)|NOW|RAND|GENERATE_UUID|SESSION_USER)\s*\(', re.I
+)
+
+def dry_run_query(client: "bigquery.Client", query: str, limit: Optional[int] = 1000,
+                  columns: Optional[List[str]] = None) -> Dict:
+    """Dry-run query để ước tính bytes xử lý, chi phí và bảng được tham chiếu trước khi thực thi"""
+    from google.cloud import bigquery
+    try:
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        query_job = client.query(build_query_sql(query, limit, columns), job_config=job_config)
+    except Exception as e:
+        return {"error": str(e)}
+
+    bytes_processed = query_job.total_bytes_processed or 0
+    return {
+        "bytes_processed": bytes_processed,
+        "estimated_cost": bytes_processed / 1024**4 * PRICE_PER_TIB,
+        "max_bytes_billed": MAX_BYTES_BILLED,
+        "within_budget": bytes_processed <= MAX_BYTES_BILLED,
+        "referenced_tables": [
+            f"{table.project}.{table.dataset_id}.{table.table_id}" for table in (query_job.referenced_tables or [])
+        ],
+        "cache_eligible": not _NON_CACHEABLE_PATTERN.search(query),
+        "schema": [field.name for field in (query_job.schema or [])]
+    }
+
+def run_query(client: "bigquery.Client", query: str, limit: Optional[int] = 1000, columns: Optional[List[str]] = None,
+              cache: Optional[QueryResultCache] = None, cache_ttl: Optional[int] = None,
+              metrics: Optional[MetricsRegistry] = None) -> pd.DataFrame:
+    """Thực thi query và trả về kết quả dạng DataFrame (ưu tiên đọc từ cache trên đĩa nếu có cache)"""
+    if cache is not None:
+        df = cache.get(query, limit, columns, ttl=cache_ttl)
+        if metrics is not None:
+            metrics.inc("query_cache_requests_total", 1, "Số lần tra cache kết quả query",
+                        result="hit" if df is not None else "miss")
+        if df is not None:
+            df.attrs["cache_hit"] = True
+            return df
+
+    from google.cloud import bigquery
+    sql = build_query_sql(query, limit, columns)
+    job_config = bigquery.QueryJobConfig(
+        maximum_bytes_billed=MAX_BYTES_BILLED,
+        use_query_cache=True
+    )
+
+    with track_phase(metrics, "bq_query"):
+        query_job = client.query(sql, job_config=job_config)
+        query_job.result()
+        note_phase(num_bytes=query_job.total_bytes_processed or 0)
+    with track_phase(metrics, "bq_download", job_id=query_job.job_id):
+        df = query_job.to_dataframe()
+        note_phase(rows=len(df), num_bytes=int(df.memory_usage(deep=True).sum()))
+    destination = query_job.destination
+    if destination is not None:
+        # Bảng kết quả tạm của query (còn khoảng 24 giờ), dùng để đọc lại từng trang khi cần
+        df.attrs["destination"] = f"{destination.project}.{destination.dataset_id}.{destination.table_id}"
+    if cache is not None:
+        cache.put(query, limit, df, columns)
+    return df
+
+def stream_bigquery_query(query: str, page_size: int = STREAM_PAGE_SIZE,
+                          client=None) -> Tuple[int, Iterator[pd.DataFrame], Optional[str]]:
+    """Thực thi query, trả về tổng số dòng, iterator từng trang kết quả (không tải toàn bộ, không thêm LIMIT)
+    và bảng kết quả tạm của query (để đọc lại khi tiếp tục job)"""
+    if client is None:
+        raise RuntimeError("Không thể kết nối đến BigQuery")
+
+    from google.cloud import bigquery
+    job_config = bigquery.QueryJobConfig(
+        maximum_bytes_billed=MAX_BYTES_BILLED,
+        use_query_cache=True
+    )
+    query_job = client.query(strip_query(query), job_config=job_config)
+    rows = query_job.result(page_size=page_size)
+    destination = query_job.destination
+    destination_id = f"{destination.project}.{destination.dataset_id}.{destination.table_id}" if destination else None
+    return rows.total_rows or 0, rows.to_dataframe_iterable(), destination_id
+
+def list_bigquery_rows(table: str, start_index: int = 0, page_size: int = STREAM_PAGE_SIZE,
+                       client=None) -> Tuple[int, Iterator[pd.DataFrame]]:
+    """Đọc lần lượt từng trang của một bảng bắt đầu từ dòng start_index"""
+    if client is None:
+        raise RuntimeError("Không thể kết nối đến BigQuery")
+
+    rows = client.list_rows(table, start_index=start_index, page_size=page_size)
+    return rows.total_rows or 0, rows.to_dataframe_iterable()
+
+def table_exists(table: str, client=None) -> bool:
+    """Bảng còn tồn tại (bảng kết quả tạm của query bị BigQuery xóa sau khoảng 24 giờ)"""
+    if client is None:
+        raise RuntimeError("Không thể kết nối đến BigQuery")
+
+    from google.api_core.exceptions import NotFound
+    try:
+        client.get_table(table)
+    except NotFound:
+        return False
+    return True
+
+def read_table_rows(table: str, start_index: int, max_results: int, client=None) -> pd.DataFrame:
+    """Đọc các dòng [start_index, start_index + max_results) của một bảng (không quét cả bảng)"""
+    if client is None:
+        raise RuntimeError("Không thể kết nối đến BigQuery")
+
+    return client.list_rows(table, start_index=start_index, max_results=max_results).to_dataframe()
+
+def validate_query(query):
+    """Kiểm tra tính hợp lệ của SQL query (dựa trên token, không nhầm tên cột như created_at)"""
+    statements = _split_statements(_significant_tokens(query))
+    if not statements:
+        return False, "Query rỗng"
+    if len(statements) > 1:
+        return False, "Chỉ hỗ trợ một câu lệnh"
+    
+    tokens = statements[0]
+    for i, token in enumerate(tokens):
+        # Bỏ qua tên field dạng table.update
+        after_dot = i > 0 and tokens[i - 1].kind == 'punct' and tokens[i - 1].value == '.'
+        if token.keyword in DANGEROUS_KEYWORDS and not after_dot:
+            return False, f"Query chứa từ khóa nguy hiểm: {token.keyword}"
+    
+    first = tokens[0]
+    if first.keyword not in ('SELECT', 'WITH') and first.value != '(':
+        return False, "Query phải bắt đầu bằng SELECT hoặc WITH"
+    
+    return True, "Query hợp lệ"
@@ -0,0 +1,214 @@
+"""Đồng bộ BigQuery → Larkbase không cần giao diện (cron, Cloud Scheduler, Cloud Run Job).
+
+Ví dụ:
+    python cli.py --query-file nightly.sql --app-token bascXXX --table-id tblXXX --mode replace
+    python cli.py --query "SELECT * FROM ds.orders" --app-token bascXXX --table-id tblXXX \\
+        --mode upsert --key-columns order_id
+
+Kết quả là một dòng JSON trên stdout; tiến độ và structured log ghi ra stderr.
+Mã thoát: 0 thành công, 1 còn batch lỗi (job giữ checkpoint để chạy lại), 2 tham số không hợp lệ, 3 job lỗi.
+Chạy lại với cùng --job-id (mặc định lấy từ CLOUD_RUN_EXECUTION/CLOUD_RUN_TASK_INDEX) sẽ tiếp tục từ checkpoint"""
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Dict, List, Optional
+
+from bigquery_utils import build_query_sql, create_bigquery_client, run_query, validate_query
+from larkbase import LarkbaseAuthenticator, LarkbaseConfig, LarkbaseHttpClient, LarkbaseRecordManager
+from metrics import MetricsRegistry, metrics_logger, serve_metrics
+from sync import SYNC_MODES, SyncCheckpointStore, SyncJob, SyncJobCancelled, run_larkbase_sync
+
+logger = logging.getLogger("bq2lark.cli")
+
+EXIT_OK = 0
+EXIT_FAILED_BATCHES = 1
+EXIT_USAGE = 2
+EXIT_ERROR = 3
+
+class LoggingSyncJob(SyncJob):
+    """SyncJob ghi tiến độ ra log thay vì để giao diện đọc; mỗi log_interval giây tối đa một dòng mỗi phase"""
+
+    def __init__(self, description: str, job_id: Optional[str] = None, log_interval: float = 10.0):
+        super().__init__(description, owner=job_id, job_id=job_id)
+        self.log_interval = log_interval
+        self._last_log = 0.0
+
+    def set_phase(self, phase: str):
+        super().set_phase(phase)
+        logger.info("[%s] %s", self.job_id, phase)
+        self._last_log = time.monotonic()
+
+    def update(self, done: int, total: int, message: str):
+        super().update(done, total, message)
+        now = time.monotonic()
+        if now - self._last_log >= self.log_interval or (total and done >= total):
+            logger.info("[%s] %s: %s/%s %s", self.job_id, self.phase, f"{done:,}", f"{total:,}", message)
+            self._last_log = now
+
+def default_job_id() -> Optional[str]:
+    """Job ID ổn định giữa các lần retry của cùng một task Cloud Run Job"""
+    execution = os.getenv('CLOUD_RUN_EXECUTION')
+    if not execution:
+        return None
+    return f"{execution}-{os.getenv('CLOUD_RUN_TASK_INDEX', '0')}"
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Đồng bộ kết quả query BigQuery sang bảng Larkbase")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--query", help="Câu query SELECT")
+    source.add_argument("--query-file", help="File chứa query ('-' để đọc từ stdin)")
+    parser.add_argument("--app-token", required=True, help="App token của Larkbase (Base)")
+    parser.add_argument("--table-id", required=True, help="ID bảng Larkbase")
+    parser.add_argument("--mode", choices=list(SYNC_MODES), default="append", help="Chế độ ghi dữ liệu")
+    parser.add_argument("--key-columns", default="", help="Cột khóa cho chế độ upsert, phân tách bằng dấu phẩy")
+    parser.add_argument("--no-delete-missing", dest="delete_missing", action="store_false",
+                        help="Upsert: giữ lại các dòng trên Larkbase không còn trong kết quả query")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Giới hạn số dòng; bỏ trống thì append/replace streaming toàn bộ kết quả theo trang")
+    parser.add_argument("--job-id", default=default_job_id(), help="ID job, dùng lại để tiếp tục từ checkpoint")
+    parser.add_argument("--max-concurrent-batches", type=int, default=None, help="Số batch gửi song song")
+    parser.add_argument("--log-interval", type=float, default=10.0, help="Chu kỳ ghi log tiến độ (giây)")
+    return parser.parse_args(argv)
+
+def read_query(args: argparse.Namespace) -> str:
+    if args.query is not None:
+        return args.query
+    if args.query_file == "-":
+        return sys.stdin.read()
+    with open(args.query_file, encoding="utf-8") as f:
+        return f.read()
+
+def summarize(job: SyncJob, summary: Optional[Dict], resumed: bool) -> Dict:
+    """Tóm tắt kết quả dạng JSON cho scheduler/người vận hành"""
+    cleared = (summary or {}).get("cleared")
+    # Lỗi khi xóa dữ liệu cũ cũng tính là batch lỗi (chạy lại sẽ xóa tiếp)
+    results = (summary or {}).get("results", []) + (cleared["results"] if cleared else [])
+    errors = [r for r in results if r.get("status") == "error"]
+    deleted = sum(r.get("deleted_count", 0) for r in cleared["results"] if r.get("status") == "success") if cleared else 0
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "resumed": resumed,
+        "sync_mode": (summary or {}).get("sync_mode"),
+        "written_rows": (summary or {}).get("written_count", 0),
+        "skipped_rows": (summary or {}).get("skipped_rows", 0),
+        "deleted_rows": deleted,
+        "upsert": (summary or {}).get("upsert"),
+        "batches": len(results),
+        "error_batches": len(errors),
+        "errors": [{
+            "rows": r.get("rows"),
+            "action": r.get("action"),
+            "error": r.get("msg") or r.get("exception"),
+            "code": r.get("code"),
+            "status_code": r.get("status_code")
+        } for r in errors[:20]],
+        "error": job.error,
+        "elapsed_seconds": round((job.finished_at or time.time()) - (job.started_at or job.created_at), 3)
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # stdout chỉ dành cho bản tóm tắt JSON
+    for handler in metrics_logger.handlers:
+        if isinstance(handler, logging.StreamHandler):
+            handler.setStream(sys.stderr)
+
+    args = parse_args(argv)
+    try:
+        query = read_query(args)
+    except OSError as e:
+        logger.error("Không đọc được query: %s", e)
+        return EXIT_USAGE
+    is_valid, message = validate_query(query)
+    if not is_valid:
+        logger.error("Query không hợp lệ: %s", message)
+        return EXIT_USAGE
+    key_columns = [c.strip() for c in args.key_columns.split(",") if c.strip()]
+    if args.mode == "upsert" and not key_columns:
+        logger.error("Chế độ upsert cần --key-columns")
+        return EXIT_USAGE
+
+    metrics = MetricsRegistry()
+    if os.getenv('METRICS_PORT'):
+        serve_metrics(metrics, int(os.getenv('METRICS_PORT')))
+
+    # Upsert cần toàn bộ dữ liệu để so sánh theo khóa; append/replace không giới hạn thì streaming theo trang
+    stream_sql = build_query_sql(query, None) if args.limit is None and args.mode != "upsert" else None
+    params = {
+        "description": f"{SYNC_MODES[args.mode]} → {args.table_id}",
+        "query": query,
+        "columns": None,
+        "app_token": args.app_token,
+        "table_id": args.table_id,
+        "sync_mode": args.mode,
+        "stream_sql": stream_sql,
+        "key_columns": key_columns,
+        "delete_missing": args.delete_missing,
+        "max_concurrent_batches": args.max_concurrent_batches
+    }
+
+    store = SyncCheckpointStore()
+    checkpoint = store.load(args.job_id) if args.job_id else None
+    resumed = checkpoint is not None and checkpoint.meta.get("status") != "succeeded"
+    if resumed and checkpoint.meta["params"] != params:
+        logger.error("Job %s đã có checkpoint với tham số khác; dùng --job-id khác", args.job_id)
+        return EXIT_USAGE
+
+    job = LoggingSyncJob(params["description"], job_id=args.job_id, log_interval=args.log_interval)
+    job.status = "running"
+    # Cloud Run gửi SIGTERM khi task hết thời gian: dừng sau batch đang gửi, checkpoint giữ phần đã ghi
+    signal.signal(signal.SIGTERM, lambda signum, frame: job.cancel())
+    job.started_at = time.time()
+    summary = None
+    try:
+        config = LarkbaseConfig(
+            app_id=os.getenv('LARKBASE_APP_ID'), app_secret=os.getenv('LARKBASE_APP_SECRET'),
+            api_endpoint=os.getenv('LARKBASE_API_ENDPOINT'), max_concurrent_batches=args.max_concurrent_batches
+        )
+        authenticator = LarkbaseAuthenticator(config, LarkbaseHttpClient(metrics=metrics))
+        access_token = authenticator.authenticate()
+        if not access_token:
+            raise RuntimeError(authenticator.last_error or "Không xác thực được Larkbase")
+        record_manager = LarkbaseRecordManager(access_token, config, authenticator.http, authenticator,
+                                               owner=job.job_id)
+
+        client = create_bigquery_client()
+        df = None
+        if resumed:
+            logger.info("Tiếp tục job %s từ checkpoint (đã ghi %s dòng)", job.job_id,
+                        f"{checkpoint.completed_row_count:,}")
+            if not stream_sql:
+                df = checkpoint.load_snapshot()
+        if not stream_sql and df is None:
+            job.set_phase("🔍 Chạy query BigQuery")
+            df = run_query(client, query, args.limit, metrics=metrics)
+        if not resumed:
+            checkpoint = store.create(job.job_id, params, None if stream_sql else df, owner=job.owner)
+
+        summary = run_larkbase_sync(job, record_manager, args.app_token, args.table_id, args.mode, df=df,
+                                    stream_sql=stream_sql, key_columns=key_columns,
+                                    delete_missing=args.delete_missing, bigquery_client=client,
+                                    checkpoint=checkpoint)
+        job.status = "succeeded"
+    except SyncJobCancelled:
+        job.status = "cancelled"
+    except Exception as e:
+        logger.exception("Job %s lỗi", job.job_id)
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        job.finished_at = time.time()
+
+    result = summarize(job, summary, resumed)
+    print(json.dumps(result, ensure_ascii=False, default=str))
+    if job.status != "succeeded":
+        return EXIT_ERROR
+    return EXIT_FAILED_BATCHES if result["error_batches"] else EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Xuất kết quả query ra file theo yêu cầu: ghi lần lượt từng đoạn dòng nên bộ nhớ chỉ tỉ lệ với một đoạn,
+file tạo xong được giữ cùng kết quả trong result store để tải lại không phải ghi lại. Không phụ thuộc Streamlit"""
+import os
+import threading
+from contextlib import contextmanager
+from typing import IO, Dict, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from metrics import MetricsRegistry, note_phase, track_phase
+from result_store import ResultEvicted, ResultHandle, SessionResultStore
+
+# Số dòng mỗi đoạn khi ghi file export
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 50000))
+
+EXPORT_FORMATS = {
+    "csv": {"label": "CSV", "extension": "csv", "mime": "text/csv"},
+    "json": {"label": "JSON", "extension": "json", "mime": "application/json"},
+    "jsonl": {"label": "JSON Lines", "extension": "jsonl", "mime": "application/x-ndjson"},
+    "parquet": {"label": "Parquet", "extension": "parquet", "mime": "application/vnd.apache.parquet"}
+}
+
+def write_csv(frames: Iterator[pd.DataFrame], f: IO[str]):
+    for i, df in enumerate(frames):
+        df.to_csv(f, header=i == 0, index=False)
+
+def write_jsonl(frames: Iterator[pd.DataFrame], f: IO[str]):
+    for df in frames:
+        if len(df):
+            f.write(df.to_json(orient='records', lines=True, force_ascii=False).rstrip("\n") + "\n")
+
+def write_json(frames: Iterator[pd.DataFrame], f: IO[str]):
+    """Mảng JSON các bản ghi, mỗi bản ghi một dòng (không cần giữ cả mảng trong bộ nhớ)"""
+    f.write("[")
+    first = True
+    for df in frames:
+        if not len(df):
+            continue
+        lines = df.to_json(orient='records', lines=True, force_ascii=False).rstrip("\n")
+        f.write(("\n" if first else ",\n") + lines.replace("\n", ",\n"))
+        first = False
+    f.write("\n]\n" if not first else "]\n")
+
+def write_parquet(table: pa.Table, path: str, chunk_rows: int):
+    """Parquet ghi thẳng từ bảng Arrow của result store (giữ nguyên dictionary/kiểu số gọn), từng row group"""
+    with pq.ParquetWriter(path, table.schema) as writer:
+        for start in range(0, table.num_rows, chunk_rows):
+            writer.write_table(table.slice(start, chunk_rows))
+
+# Khóa theo kết quả/định dạng đang được export kèm số thread đang dùng; khóa bị xóa khi không còn ai dùng
+_export_locks: Dict[str, List] = {}
+_export_locks_guard = threading.Lock()
+
+@contextmanager
+def _export_lock(key: str) -> Iterator[None]:
+    with _export_locks_guard:
+        entry = _export_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _export_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _export_locks[key]
+
+def export_result(store: SessionResultStore, handle: ResultHandle, fmt: str, chunk_rows: Optional[int] = None,
+                  metrics: Optional[MetricsRegistry] = None) -> Optional[str]:
+    """Đường dẫn file export của kết quả theo định dạng fmt; chỉ ghi file ở lần yêu cầu đầu tiên.
+    Trả về None nếu kết quả đã bị xóa khỏi result store"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Định dạng export không hỗ trợ: {fmt}")
+    chunk_rows = chunk_rows or EXPORT_CHUNK_ROWS
+    key = f"export.{EXPORT_FORMATS[fmt]['extension']}"
+    # Hai lần bấm cùng lúc cho cùng một kết quả chỉ ghi file một lần
+    with _export_lock(f"{handle.result_id}/{key}"):
+        path = store.get_artifact(handle, key)
+        if path is not None:
+            return path
+        table = store.get_table(handle)
+        if table is None:
+            return None
+
+        path = store.artifact_path(handle, key)
+        tmp_path = f"{path}.tmp"
+        try:
+            with track_phase(metrics, "export", format=fmt):
+                if fmt == "parquet":
+                    write_parquet(table, tmp_path, chunk_rows)
+                else:
+                    writers = {"csv": write_csv, "json": write_json, "jsonl": write_jsonl}
+                    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                        writers[fmt](store.iter_frames(handle, chunk_rows), f)
+                note_phase(rows=handle.num_rows, num_bytes=os.path.getsize(tmp_path))
+            os.replace(tmp_path, path)
+        except ResultEvicted:
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path if store.put_artifact(handle, key, path) else None
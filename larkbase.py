@@ -0,0 +1,1070 @@
+"""Client Larkbase (Lark Bitable): xác thực, rate governor, HTTP client dùng chung,
+format DataFrame và ghi/xóa/đồng bộ records theo batch. Không phụ thuộc Streamlit"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import MetricsRegistry, instrumented, note_phase
+
+logger = logging.getLogger(__name__)
+
+class LarkbaseApiError(Exception):
+    """Lỗi trả về từ API Larkbase khiến không thể tiếp tục thao tác"""
+
+# Larkbase Configuration
+class LarkbaseConfig:
+    def __init__(self, app_id=None, app_secret=None, api_endpoint=None, max_concurrent_batches=None):
+        self.app_id = app_id or 'cli_a7fab27260385010'
+        self.app_secret = app_secret or 'Zg4MVcFfiOu0g09voTcpfd4WGDpA0Ly5'
+        self.api_endpoint = api_endpoint or 'https://open.larksuite.com/open-apis'
+        # Số batch được gửi song song tối đa (1 = tuần tự như trước)
+        self.max_concurrent_batches = max(1, int(
+            max_concurrent_batches or os.getenv('LARKBASE_MAX_CONCURRENT_BATCHES', 4)
+        ))
+    
+    def to_dict(self) -> Dict:
+        return {
+            'app_id': self.app_id,
+            'app_secret': self.app_secret,
+            'api_endpoint': self.api_endpoint,
+            'max_concurrent_batches': self.max_concurrent_batches
+        }
+
+class _RateBucket:
+    """Token bucket của một (app_id, endpoint) kèm hàng đợi riêng cho từng owner (session)"""
+
+    def __init__(self, rate: float, burst: float, lock: threading.Lock):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.cond = threading.Condition(lock)
+        # owner -> hàng đợi vé; owners là vòng round-robin các owner đang chờ
+        self.queues: Dict[str, deque] = {}
+        self.owners = deque()
+        self.granted = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+class LarkbaseRateGovernor:
+    """Điều phối tần suất gọi API Larkbase cho toàn bộ process theo token bucket (app_id, endpoint).
+    Các request đang chờ được phục vụ xoay vòng giữa các owner để một session không chiếm hết quota"""
+
+    # Rút gọn đường dẫn API thành endpoint: bỏ app_token, table_id, record_id...
+    _PATH_ID_PATTERN = re.compile(r'/(apps|tables|records|fields|views)/(?!batch_)[^/]+')
+
+    def __init__(self, default_qps: Optional[float] = None, limits: Optional[Dict[str, float]] = None):
+        self.default_qps = float(default_qps or os.getenv('LARKBASE_RATE_LIMIT_QPS', 10))
+        # Giới hạn riêng theo endpoint, ví dụ {"bitable/v1/apps/*/tables/*/records/batch_create": 5}
+        self.limits = limits if limits is not None else json.loads(os.getenv('LARKBASE_RATE_LIMITS', '{}'))
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, str], _RateBucket] = {}
+
+    @classmethod
+    def endpoint_of(cls, url: str) -> str:
+        path = urlparse(url).path
+        if '/open-apis/' in path:
+            path = path.split('/open-apis/', 1)[1]
+        return cls._PATH_ID_PATTERN.sub(r'/\1/*', path.strip('/'))
+
+    def _bucket(self, app_id: str, endpoint: str) -> _RateBucket:
+        bucket = self._buckets.get((app_id, endpoint))
+        if bucket is None:
+            rate = float(self.limits.get(endpoint, self.default_qps))
+            bucket = self._buckets[(app_id, endpoint)] = _RateBucket(rate, max(1.0, rate), self._lock)
+        return bucket
+
+    def acquire(self, app_id: str, url: str, owner: str = "default") -> float:
+        """Chờ tới lượt gửi request; trả về thời gian đã chờ (giây)"""
+        started = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(app_id, self.endpoint_of(url))
+            ticket = object()
+            owner_queue = bucket.queues.get(owner)
+            if owner_queue is None:
+                owner_queue = bucket.queues[owner] = deque()
+                bucket.owners.append(owner)
+            owner_queue.append(ticket)
+
+            while True:
+                now = time.monotonic()
+                bucket.refill(now)
+                my_turn = bucket.owners[0] == owner and owner_queue[0] is ticket
+                if my_turn and bucket.tokens >= 1:
+                    break
+                # Chỉ vé đầu hàng chờ token hồi lại; các vé khác chờ tới lượt
+                bucket.cond.wait((1 - bucket.tokens) / bucket.rate if my_turn else None)
+
+            bucket.tokens -= 1
+            owner_queue.popleft()
+            bucket.owners.popleft()
+            if owner_queue:
+                bucket.owners.append(owner)
+            else:
+                del bucket.queues[owner]
+
+            waited = time.monotonic() - started
+            bucket.granted += 1
+            bucket.total_wait += waited
+            bucket.max_wait = max(bucket.max_wait, waited)
+            bucket.cond.notify_all()
+            return waited
+
+    def penalize(self, app_id: str, url: str, delay: float):
+        """Server báo vượt quota: tạm dừng cấp token cho endpoint trong khoảng delay giây"""
+        with self._lock:
+            bucket = self._bucket(app_id, self.endpoint_of(url))
+            bucket.refill(time.monotonic())
+            bucket.tokens = min(bucket.tokens, -delay * bucket.rate)
+            bucket.throttled += 1
+            bucket.cond.notify_all()
+
+    def stats(self) -> List[Dict]:
+        """Trạng thái từng bucket: hàng đợi, số owner đang chờ và thời gian chờ"""
+        with self._lock:
+            return [{
+                "app_id": app_id,
+                "endpoint": endpoint,
+                "qps": bucket.rate,
+                "queue_depth": bucket.queue_depth,
+                "waiting_owners": len(bucket.queues),
+                "granted": bucket.granted,
+                "throttled": bucket.throttled,
+                "avg_wait": bucket.total_wait / bucket.granted if bucket.granted else 0.0,
+                "max_wait": bucket.max_wait
+            } for (app_id, endpoint), bucket in self._buckets.items()]
+
+class LarkbaseHttpClient:
+    """Session HTTP dùng chung cho các API Larkbase: keep-alive, connection pool và retry với backoff"""
+
+    # Mã lỗi Lark khi vượt giới hạn tần suất gọi API
+    RATE_LIMIT_CODES = {99991400}
+    RETRY_STATUS_CODES = {500, 502, 503, 504}
+    IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+    def __init__(self, pool_size: int = None, max_retries: int = None, backoff_base: float = 0.5,
+                 backoff_max: float = 30.0, timeout=(10, 120), governor: Optional[LarkbaseRateGovernor] = None,
+                 metrics: Optional[MetricsRegistry] = None):
+        self.governor = governor
+        self.metrics = metrics
+        self.pool_size = int(pool_size or os.getenv('LARKBASE_HTTP_POOL_SIZE', 32))
+        self.max_retries = int(max_retries if max_retries is not None else os.getenv('LARKBASE_HTTP_MAX_RETRIES', 5))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method: str, url: str, idempotent: Optional[bool] = None, app_id: Optional[str] = None,
+                owner: str = "default", **kwargs) -> requests.Response:
+        """Gửi request, tự retry khi bị giới hạn tần suất (429) hoặc lỗi tạm thời với request idempotent.
+        Có app_id thì mỗi lần gửi (kể cả retry) đều chờ lượt qua rate governor"""
+        if idempotent is None:
+            idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.timeout)
+        governed = self.governor is not None and app_id is not None
+        endpoint = LarkbaseRateGovernor.endpoint_of(url)
+
+        attempt = 0
+        while True:
+            if governed:
+                waited = self.governor.acquire(app_id, url, owner)
+                self._observe("larkbase_rate_wait_seconds", waited, "Thời gian chờ rate governor", endpoint=endpoint)
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._observe("larkbase_request_duration_seconds", time.monotonic() - started,
+                              "Độ trễ mỗi request Larkbase", endpoint=endpoint, method=method, status="exception")
+                # ConnectTimeout nghĩa là request chưa tới server nên luôn retry được
+                retryable = isinstance(e, requests.exceptions.ConnectTimeout) or (
+                    idempotent and isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                )
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                reason = "network"
+            else:
+                self._observe("larkbase_request_duration_seconds", time.monotonic() - started,
+                              "Độ trễ mỗi request Larkbase", endpoint=endpoint, method=method,
+                              status=str(response.status_code))
+                throttled = response.status_code == 429 or self._is_rate_limited(response)
+                if throttled and governed:
+                    self.governor.penalize(app_id, url, self._retry_delay(response, attempt))
+                if attempt >= self.max_retries or not self._should_retry(response, idempotent):
+                    return response
+                delay = self._retry_delay(response, attempt)
+                reason = "rate_limit" if throttled else "server_error"
+
+            if self.metrics is not None:
+                self.metrics.inc("larkbase_request_retries_total", 1, "Số lần retry request Larkbase",
+                                 endpoint=endpoint, reason=reason)
+            attempt += 1
+            time.sleep(delay)
+
+    def _observe(self, name: str, value: float, description: str, **labels):
+        if self.metrics is not None:
+            self.metrics.observe(name, value, description, **labels)
+
+    def _should_retry(self, response: requests.Response, idempotent: bool) -> bool:
+        if response.status_code == 429 or self._is_rate_limited(response):
+            # Request bị từ chối trước khi xử lý nên retry an toàn kể cả với batch_create
+            return True
+        return idempotent and response.status_code in self.RETRY_STATUS_CODES
+
+    def _is_rate_limited(self, response: requests.Response) -> bool:
+        if response.status_code != 400:
+            return False
+        try:
+            return response.json().get('code') in self.RATE_LIMIT_CODES
+        except ValueError:
+            return False
+
+    def _retry_delay(self, response: requests.Response, attempt: int) -> float:
+        """Ưu tiên thời gian chờ do server trả về (Retry-After / x-ogw-ratelimit-reset)"""
+        for header in ('Retry-After', 'x-ogw-ratelimit-reset'):
+            value = response.headers.get(header)
+            if value:
+                try:
+                    return min(float(value), self.backoff_max) + random.uniform(0, self.backoff_base)
+                except ValueError:
+                    pass
+        return self._backoff_delay(attempt)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff với full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+class LarkbaseTokenCache:
+    """Cache tenant access token theo app_id, dùng chung giữa các session"""
+
+    def __init__(self, refresh_margin: int = None):
+        # Làm mới token trước khi hết hạn một khoảng refresh_margin (giây)
+        self.refresh_margin = int(refresh_margin or os.getenv('LARKBASE_TOKEN_REFRESH_MARGIN', 300))
+        self._tokens: Dict[str, tuple] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def lock_for(self, app_id: str) -> threading.Lock:
+        """Lock riêng cho từng app_id để chỉ một thread gọi API lấy token"""
+        with self._guard:
+            return self._locks.setdefault(app_id, threading.Lock())
+
+    def get(self, app_id: str) -> Optional[str]:
+        entry = self._tokens.get(app_id)
+        if entry and time.time() < entry[1] - self.refresh_margin:
+            return entry[0]
+        return None
+
+    def set(self, app_id: str, token: str, expire: int):
+        self._tokens[app_id] = (token, time.time() + expire)
+
+    def invalidate(self, app_id: str, token: Optional[str] = None):
+        """Xóa token khỏi cache (chỉ khi vẫn là token đã biết bị hết hạn)"""
+        with self._guard:
+            entry = self._tokens.get(app_id)
+            if entry and (token is None or entry[0] == token):
+                del self._tokens[app_id]
+
+class LarkbaseAuthenticator:
+    def __init__(self, config: LarkbaseConfig, http: Optional[LarkbaseHttpClient] = None,
+                 token_cache: Optional[LarkbaseTokenCache] = None):
+        self.config = config
+        self.http = http or LarkbaseHttpClient()
+        self.token_cache = token_cache or LarkbaseTokenCache()
+        self.metrics = self.http.metrics
+        # Lỗi của lần xác thực gần nhất (để UI hiển thị; có thể được gọi từ thread nền)
+        self.last_error: Optional[str] = None
+    
+    def authenticate(self, force_refresh: bool = False) -> Optional[str]:
+        """Lấy access token từ cache, chỉ gọi API Larkbase khi token sắp hết hạn"""
+        if not force_refresh:
+            token = self.token_cache.get(self.config.app_id)
+            if token:
+                self._count_token_request("cache_hit")
+                return token
+
+        with self.token_cache.lock_for(self.config.app_id):
+            # Thread khác có thể vừa làm mới token trong lúc chờ lock
+            if not force_refresh:
+                token = self.token_cache.get(self.config.app_id)
+                if token:
+                    self._count_token_request("cache_hit")
+                    return token
+            token = self._fetch_token()
+            self._count_token_request("fetched" if token else "error")
+            return token
+
+    def _count_token_request(self, result: str):
+        if self.metrics is not None:
+            self.metrics.inc("larkbase_token_requests_total", 1, "Số lần lấy access token", result=result)
+
+    @instrumented("larkbase_auth")
+    def _fetch_token(self) -> Optional[str]:
+        """Xác thực với API Larkbase để lấy access token"""
+        try:
+            url = f"{self.config.api_endpoint}/auth/v3/tenant_access_token/internal"
+            response = self.http.request('POST', url, idempotent=True, app_id=self.config.app_id, json={
+                'app_id': self.config.app_id, 
+                'app_secret': self.config.app_secret
+            })
+            response.raise_for_status()
+            data = response.json()
+            
+            if data.get('code') == 0:
+                token = data.get('tenant_access_token')
+                self.token_cache.set(self.config.app_id, token, int(data.get('expire', 0)))
+                self.last_error = None
+                return token
+            else:
+                self.last_error = f"Lỗi API Larkbase: {data.get('msg', 'Không xác định')}"
+        except Exception as e:
+            self.last_error = f"Lỗi xác thực Larkbase: {str(e)}"
+        logger.error(self.last_error)
+        return None
+
+class LarkbaseRecordFormatter:
+    """Chuyển DataFrame thành payload Larkbase theo từng cột (vectorized) dựa trên schema của bảng"""
+
+    # Loại field của Lark Bitable
+    FIELD_TEXT = 1
+    FIELD_NUMBER = 2
+    FIELD_SINGLE_SELECT = 3
+    FIELD_MULTI_SELECT = 4
+    FIELD_DATETIME = 5
+    FIELD_CHECKBOX = 7
+    FIELD_URL = 15
+
+    EPOCH = pd.Timestamp(0, tz='UTC')
+
+    def __init__(self, field_types: Optional[Dict[str, int]] = None, metrics: Optional[MetricsRegistry] = None):
+        # field_types: tên field -> loại field; rỗng thì chuyển đổi theo dtype của cột
+        self.field_types = field_types or {}
+        self.metrics = metrics
+
+    @instrumented("format")
+    def format_dataframe(self, df: pd.DataFrame) -> List[Dict]:
+        """Chuyển toàn bộ DataFrame thành danh sách {"fields": {...}}"""
+        if df.empty:
+            return []
+        note_phase(rows=len(df))
+        columns = [str(col) for col in df.columns]
+        values = [self._convert_column(df.iloc[:, i], self.field_types.get(col)) for i, col in enumerate(columns)]
+        return [{"fields": dict(zip(columns, row))} for row in zip(*values)]
+
+    def lazy(self, df: pd.DataFrame, chunk_rows: Optional[int] = None) -> "LazyFormattedRecords":
+        """Payload của DataFrame được format dần theo từng đoạn khi cần (xem LazyFormattedRecords)"""
+        return LazyFormattedRecords(self, df, chunk_rows)
+
+    def _convert_column(self, series: pd.Series, field_type: Optional[int]) -> List:
+        mask = series.isna().to_numpy()
+
+        if field_type == self.FIELD_DATETIME:
+            # Lark nhận thời gian dạng epoch milliseconds; giá trị không có timezone được coi là UTC
+            dt = pd.to_datetime(series, errors='coerce', utc=True)
+            mask = dt.isna().to_numpy()
+            millis = ((dt - self.EPOCH) // pd.Timedelta(milliseconds=1)).to_numpy(dtype='float64', na_value=np.nan)
+            return _fill_masked(np.nan_to_num(millis).astype('int64'), mask, None)
+
+        if field_type == self.FIELD_NUMBER or (field_type is None and _is_numeric_series(series)):
+            numeric = pd.to_numeric(series, errors='coerce')
+            mask = numeric.isna().to_numpy()
+            if pd.api.types.is_integer_dtype(numeric) and not mask.any():
+                return numeric.to_numpy(dtype='int64').tolist()
+            return _fill_masked(numeric.to_numpy(dtype='float64', na_value=np.nan), mask, None)
+
+        if field_type == self.FIELD_CHECKBOX or (field_type is None and pd.api.types.is_bool_dtype(series)):
+            return series.fillna(False).astype(bool).to_numpy().tolist()
+
+        text = _fill_masked(series.astype(str).to_numpy(dtype=object), mask, "")
+
+        if field_type == self.FIELD_MULTI_SELECT:
+            return [[part.strip() for part in value.split(',') if part.strip()] if value else None
+                    for value in text]
+        if field_type == self.FIELD_URL:
+            return [{"text": value, "link": value} if value else None for value in text]
+        return text
+
+def _is_numeric_series(series: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+def _fill_masked(values: np.ndarray, mask: np.ndarray, fill) -> List:
+    """Chuyển mảng NumPy thành list kiểu Python, thay các vị trí bị mask bằng fill"""
+    result = values.tolist()
+    for i in np.flatnonzero(mask).tolist():
+        result[i] = fill
+    return result
+
+class LazyFormattedRecords:
+    """Danh sách {"fields": {...}} của DataFrame, format theo từng đoạn chunk_rows dòng khi được đọc tới.
+    Chỉ giữ đoạn đang đọc trong bộ nhớ thay vì payload của cả DataFrame; đọc theo thứ tự dòng tăng dần
+    (như _run_batches) thì mỗi đoạn chỉ format một lần. Không an toàn khi đọc từ nhiều thread"""
+
+    def __init__(self, formatter: LarkbaseRecordFormatter, df: pd.DataFrame, chunk_rows: Optional[int] = None):
+        self.formatter = formatter
+        self.df = df
+        self.chunk_rows = max(1, int(chunk_rows or os.getenv('LARKBASE_FORMAT_CHUNK_ROWS', 5000)))
+        self._chunk_start: Optional[int] = None
+        self._chunk: List[Dict] = []
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def __getitem__(self, i: int) -> Dict:
+        if not 0 <= i < len(self.df):
+            raise IndexError(i)
+        start = i - i % self.chunk_rows
+        if start != self._chunk_start:
+            self._chunk = self.formatter.format_dataframe(self.df.iloc[start:start + self.chunk_rows])
+            self._chunk_start = start
+        return self._chunk[i - start]
+
+class AdaptiveBatchSizer:
+    """Kích thước batch tự điều chỉnh theo AIMD: tăng dần khi API phản hồi nhanh,
+    giảm khi chậm hơn target_latency hoặc khi batch bị lỗi; luôn giới hạn theo số bytes payload"""
+
+    def __init__(self, max_records: int = 500, min_records: int = 10, max_bytes: Optional[int] = None,
+                 target_latency: Optional[float] = None):
+        self.max_records = max_records
+        self.min_records = max(1, min(min_records, max_records))
+        self.max_bytes = int(max_bytes or os.getenv('LARKBASE_BATCH_MAX_BYTES', 4 * 1024 * 1024))
+        self.target_latency = float(target_latency or os.getenv('LARKBASE_BATCH_TARGET_LATENCY', 5.0))
+        self.batch_size = max_records
+
+    def observe(self, result: Dict, batch_len: int):
+        """Cập nhật kích thước batch từ kết quả một batch (gọi trên thread điều phối)"""
+        latency = result.get("latency")
+        if result.get("status") != "success":
+            # Lỗi dữ liệu của một dòng (có mã lỗi Lark) không liên quan tới kích thước batch;
+            # timeout, lỗi kết nối hay payload quá lớn thì giảm một nửa
+            if result.get("code") is None:
+                self.batch_size = max(self.min_records, self.batch_size // 2)
+        elif latency is not None and latency > self.target_latency:
+            self.batch_size = max(self.min_records, int(self.batch_size * 0.75))
+        elif batch_len >= self.batch_size:
+            # Chỉ tăng khi batch thực sự đầy (batch bị cắt theo bytes không nói gì về giới hạn số lượng)
+            self.batch_size = min(self.max_records, self.batch_size + max(1, self.max_records // 10))
+
+class LarkbaseRecordManager:
+    # Mã lỗi Lark khi tenant access token không hợp lệ hoặc đã hết hạn
+    TOKEN_EXPIRED_CODES = {99991663, 99991668, 99991677}
+    # Lỗi của cả bảng: app_token/table_id sai hoặc không tồn tại, tên field không có trong bảng, bảng đầy,
+    # Base không hỗ trợ thao tác
+    TABLE_ERROR_CODES = {
+        1254003,  # WrongBaseToken
+        1254004,  # WrongTableId
+        1254040,  # BaseTokenNotFound
+        1254041,  # TableIdNotFound
+        1254044,  # FieldIdNotFound
+        1254045,  # FieldNameNotFound
+        1254103,  # RecordExceedLimit
+        1254301,  # OperationTypeError
+    }
+    # Lỗi chuyển đổi giá trị của từng dòng (TextFieldConvFail, NumberFieldConvFail, ...): luôn chia tới dòng lỗi
+    # kể cả khi cả hai nửa batch cùng lỗi (các dòng lỗi nằm ở cả hai nửa)
+    ROW_DATA_ERROR_CODES = set(range(1254060, 1254080))
+    # Lỗi không phụ thuộc dữ liệu từng dòng (quyền, token, giới hạn tần suất, bảng): chia nhỏ batch không giúp gì
+    NON_BISECT_CODES = (TOKEN_EXPIRED_CODES | LarkbaseHttpClient.RATE_LIMIT_CODES | {91402, 91403, 1254302}
+                        | TABLE_ERROR_CODES)
+
+    def __init__(self, access_token: str, config: LarkbaseConfig, http: Optional[LarkbaseHttpClient] = None,
+                 authenticator: Optional[LarkbaseAuthenticator] = None, owner: str = "default"):
+        self.access_token = access_token
+        self.config = config
+        # Định danh session dùng để chia đều quota API giữa các session
+        self.owner = owner
+        self.http = http or LarkbaseHttpClient()
+        self.authenticator = authenticator
+        self.metrics = self.http.metrics
+        self._refresh_lock = threading.Lock()
+        self._sizers: Dict[str, AdaptiveBatchSizer] = {}
+
+    def _request(self, method: str, url: str, idempotent: Optional[bool] = None, **kwargs) -> requests.Response:
+        """Gửi request kèm access token; nếu token hết hạn giữa chừng thì làm mới một lần rồi gửi lại"""
+        token = self.access_token
+        response = self.http.request(method, url, idempotent=idempotent, app_id=self.config.app_id, owner=self.owner,
+                                     headers=self._headers(token), **kwargs)
+        if self.authenticator is None or not self._is_token_expired(response):
+            return response
+
+        with self._refresh_lock:
+            # Chỉ làm mới nếu chưa có worker nào khác làm mới token này
+            if self.access_token == token:
+                self.authenticator.token_cache.invalidate(self.config.app_id, token)
+                new_token = self.authenticator.authenticate(force_refresh=True)
+                if not new_token:
+                    return response
+                self.access_token = new_token
+        return self.http.request(method, url, idempotent=idempotent, app_id=self.config.app_id, owner=self.owner,
+                                 headers=self._headers(self.access_token), **kwargs)
+
+    @staticmethod
+    def _headers(token: str) -> Dict:
+        return {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+
+    def _is_token_expired(self, response: requests.Response) -> bool:
+        if response.status_code < 400:
+            return False
+        try:
+            return response.json().get('code') in self.TOKEN_EXPIRED_CODES
+        except ValueError:
+            return False
+    
+    def _iter_record_pages(self, app_token: str, table_id: str,
+                           field_names: Optional[List[str]] = None) -> Iterator[List[Dict]]:
+        """Duyệt lần lượt từng trang records của bảng (field_names=[] để chỉ lấy record_id)"""
+        url = f"{self.config.api_endpoint}/bitable/v1/apps/{app_token}/tables/{table_id}/records"
+        page_token = None
+        
+        while True:
+            params = {"page_size": 500}
+            if page_token:
+                params["page_token"] = page_token
+            if field_names is not None:
+                params["field_names"] = json.dumps(field_names, ensure_ascii=False)
+            
+            response = self._request('GET', url, params=params)
+            
+            try:
+                data = response.json()
+            except Exception as e:
+                raise LarkbaseApiError(f"Lỗi parse response: {str(e)}") from e
+            if data.get('code') != 0:
+                # Dừng hẳn thay vì trả về danh sách thiếu (tránh xóa/tạo trùng dựa trên dữ liệu không đầy đủ)
+                raise LarkbaseApiError(f"Lỗi lấy records: {data.get('msg')}")
+            
+            items = data.get('data', {}).get('items') or []
+            note_phase(rows=len(items), num_bytes=len(response.content))
+            yield items
+            
+            # Kiểm tra có trang tiếp theo không
+            page_token = data.get('data', {}).get('page_token')
+            if not page_token:
+                break
+
+    @instrumented("larkbase_list_ids")
+    def get_all_records(self, app_token: str, table_id: str) -> List[str]:
+        """Lấy tất cả record IDs từ bảng"""
+        all_record_ids = []
+        for records in self._iter_record_pages(app_token, table_id, field_names=[]):
+            all_record_ids.extend(record.get('record_id') for record in records)
+        return all_record_ids
+
+    @instrumented("larkbase_list")
+    def list_records(self, app_token: str, table_id: str, field_names: Optional[List[str]] = None) -> List[Dict]:
+        """Lấy tất cả records (record_id và fields) từ bảng"""
+        all_records = []
+        for records in self._iter_record_pages(app_token, table_id, field_names):
+            all_records.extend(records)
+        return all_records
+
+    @instrumented("larkbase_fields")
+    def get_table_fields(self, app_token: str, table_id: str) -> Dict[str, int]:
+        """Lấy schema của bảng: tên field -> loại field"""
+        url = f"{self.config.api_endpoint}/bitable/v1/apps/{app_token}/tables/{table_id}/fields"
+        field_types = {}
+        page_token = None
+
+        while True:
+            params = {"page_size": 100}
+            if page_token:
+                params["page_token"] = page_token
+            try:
+                data = self._request('GET', url, params=params).json()
+            except Exception as e:
+                logger.warning("Không lấy được schema bảng, dùng kiểu dữ liệu của DataFrame: %s", e)
+                break
+            if data.get('code') != 0:
+                logger.warning("Không lấy được schema bảng, dùng kiểu dữ liệu của DataFrame: %s", data.get('msg'))
+                break
+
+            for field in data.get('data', {}).get('items') or []:
+                field_types[field.get('field_name')] = field.get('type')
+            page_token = data.get('data', {}).get('page_token')
+            if not data.get('data', {}).get('has_more') or not page_token:
+                break
+
+        return field_types
+
+    def get_formatter(self, app_token: str, table_id: str) -> LarkbaseRecordFormatter:
+        """Tạo formatter theo schema hiện tại của bảng (chỉ gọi API lấy schema một lần)"""
+        return LarkbaseRecordFormatter(self.get_table_fields(app_token, table_id), self.metrics)
+    
+    @instrumented("larkbase_delete")
+    def batch_delete_records(self, records: List[str], app_token: str, table_id: str,
+                             max_workers: Optional[int] = None,
+                             progress_callback: Optional[Callable[[int, int, str], None]] = None) -> Dict:
+        """Xóa nhiều record khỏi bảng trên Lark Bitable (gửi song song tối đa max_workers batch)"""
+        if not records:
+            return {"status": "no_records", "message": "Không có record nào để xóa."}
+
+        url = f"{self.config.api_endpoint}/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_delete"
+        results = self._run_batches(url, records, "deleted_count", "Xóa", idempotent=True, max_workers=max_workers,
+                                    progress_callback=progress_callback)
+        errors = [r for r in results if r.get("status") != "success"]
+
+        summary = {
+            "total_batches": len(results),
+            "total_records": len(records),
+            "success_batches": len(results) - len(errors),
+            "error_batches": len(errors),
+            "results": results,
+            "errors": errors
+        }
+
+        return summary
+
+    @instrumented("larkbase_clear")
+    def clear_table(self, app_token: str, table_id: str, max_workers: Optional[int] = None,
+                    progress_callback: Optional[Callable[[int, int, str], None]] = None, max_passes: int = 5) -> Dict:
+        """Xóa toàn bộ records: lấy danh sách ID (không kèm fields) và xóa song song ngay khi đủ một trang"""
+        url = f"{self.config.api_endpoint}/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_delete"
+        max_workers = max(1, max_workers or self.config.max_concurrent_batches)
+        if progress_callback is None:
+            progress_callback = no_progress
+
+        results: List[Dict] = []
+        state = {"found": 0, "deleted": 0}
+        pending = {}
+
+        def collect(done_futures):
+            for future in done_futures:
+                batch_len = pending.pop(future)
+                result = future.result()
+                results.append(result)
+                if result["status"] == "success":
+                    state["deleted"] += batch_len
+                progress_callback(state["deleted"], max(state["found"], 1),
+                                  f"Đã xóa {state['deleted']:,}/{state['found']:,} bản ghi")
+
+        batch_index = 0
+        passes = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Xóa trong lúc phân trang có thể làm lệch page_token, nên lặp lại cho tới khi bảng trống
+            while passes < max_passes:
+                passes += 1
+                found_in_pass = 0
+                for page in self._iter_record_pages(app_token, table_id, field_names=[]):
+                    record_ids = [record.get('record_id') for record in page]
+                    if not record_ids:
+                        continue
+                    found_in_pass += len(record_ids)
+                    state["found"] += len(record_ids)
+
+                    if len(pending) >= max_workers:
+                        collect(wait(pending, return_when=FIRST_COMPLETED)[0])
+                    body = json.dumps({"records": record_ids}).encode('utf-8')
+                    future = executor.submit(self._send_batch, url, body, batch_index, "deleted_count", True)
+                    pending[future] = len(record_ids)
+                    batch_index += 1
+
+                if pending:
+                    collect(wait(pending)[0])
+                if found_in_pass == 0 or any(r["status"] != "success" for r in results):
+                    break
+
+        results.sort(key=lambda r: r["batch"])
+        errors = [r for r in results if r["status"] != "success"]
+        return {
+            "total_batches": len(results),
+            "total_records": state["found"],
+            "deleted_records": state["deleted"],
+            "success_batches": len(results) - len(errors),
+            "error_batches": len(errors),
+            "passes": passes,
+            "results": results,
+            "errors": errors
+        }
+    
+    def batch_create_records(self, records: Union[pd.DataFrame, List[Dict]], app_token: str, table_id: str,
+                             batch_size: int = 500, max_workers: Optional[int] = None,
+                             progress_callback: Optional[Callable[[int, int, str], None]] = None,
+                             on_batch_done: Optional[Callable[[int, int, Dict], None]] = None) -> List[Dict]:
+        """Tạo nhiều record mới trong bảng trên Lark Bitable (gửi song song tối đa max_workers batch)"""
+        if len(records) == 0:
+            return [{"status": "no_records", "message": "Không có record nào để tạo."}]
+
+        if isinstance(records, pd.DataFrame):
+            # DataFrame được format theo từng cột dựa trên schema của bảng, từng đoạn trong lúc gửi
+            payload = self.get_formatter(app_token, table_id).lazy(records)
+        else:
+            payload = self._format_batch(records)
+        return self._create_payload(payload, app_token, table_id, batch_size, max_workers,
+                                    progress_callback, on_batch_done)
+
+    @instrumented("larkbase_create")
+    def _create_payload(self, payload: Sequence[Dict], app_token: str, table_id: str, batch_size: int = 500,
+                        max_workers: Optional[int] = None,
+                        progress_callback: Optional[Callable[[int, int, str], None]] = None,
+                        on_batch_done: Optional[Callable[[int, int, Dict], None]] = None) -> List[Dict]:
+        """Gửi các record đã format tới /records/batch_create (batch_size là số record tối đa mỗi batch)"""
+        url = f"{self.config.api_endpoint}/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_create"
+        # batch_create không idempotent: chỉ retry khi request chắc chắn bị từ chối (429/rate limit)
+        return self._run_batches(url, payload, "created_count", "Tạo", idempotent=False, max_batch_size=batch_size,
+                                 max_workers=max_workers, progress_callback=progress_callback,
+                                 on_batch_done=on_batch_done)
+
+    @instrumented("larkbase_update")
+    def batch_update_records(self, records: List[Dict], app_token: str, table_id: str, batch_size: int = 500,
+                             max_workers: Optional[int] = None,
+                             progress_callback: Optional[Callable[[int, int, str], None]] = None) -> List[Dict]:
+        """Cập nhật nhiều record (dạng {"record_id", "fields"} đã format) trên Lark Bitable"""
+        if not records:
+            return [{"status": "no_records", "message": "Không có record nào để cập nhật."}]
+
+        url = f"{self.config.api_endpoint}/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_update"
+        return self._run_batches(url, records, "updated_count", "Cập nhật", idempotent=True, max_batch_size=batch_size,
+                                 max_workers=max_workers, progress_callback=progress_callback)
+
+    def _run_batches(self, url: str, records: Sequence, count_key: str, action: str, idempotent: bool,
+                     max_batch_size: int = 500, max_workers: Optional[int] = None,
+                     progress_callback: Optional[Callable[[int, int, str], None]] = None,
+                     on_batch_done: Optional[Callable[[int, int, Dict], None]] = None) -> List[Dict]:
+        """Chia records thành batch theo số lượng lẫn số bytes payload rồi gửi song song.
+        Batch bị API từ chối được chia đôi và gửi lại cho tới khi khoanh vùng được dòng lỗi;
+        kết quả trả về theo thứ tự dòng, mỗi kết quả có "rows" = [start, end).
+        on_batch_done(start, end, result) được gọi trên thread gọi hàm khi mỗi batch xong"""
+        total_records = len(records)
+        sizer = self._batch_sizer(count_key, max_batch_size)
+        max_workers = max(1, max_workers or self.config.max_concurrent_batches)
+        if progress_callback is None:
+            progress_callback = no_progress
+
+        # JSON của từng record chỉ serialize một lần, dùng cho cả tính kích thước lẫn body request
+        encoded: List[Optional[bytes]] = [None] * total_records
+        retry_ranges = deque()
+        state = {"cursor": 0, "done": 0, "sent": 0, "bytes": 0}
+        results: List[Dict] = []
+
+        def encode(i: int) -> bytes:
+            if encoded[i] is None:
+                encoded[i] = json.dumps(records[i], ensure_ascii=False).encode('utf-8')
+            return encoded[i]
+
+        def next_range() -> Optional[Tuple[int, int]]:
+            # Nửa batch cần gửi lại được ưu tiên trước batch mới
+            if retry_ranges:
+                return retry_ranges.popleft()
+            start = end = state["cursor"]
+            payload_bytes = 0
+            while end < total_records and end - start < sizer.batch_size:
+                record_bytes = len(encode(end)) + 1
+                if end > start and payload_bytes + record_bytes > sizer.max_bytes:
+                    break
+                payload_bytes += record_bytes
+                end += 1
+            state["cursor"] = end
+            return (start, end) if end > start else None
+
+        # Nửa batch -> (batch cha, mã lỗi của batch cha); batch cha -> nửa xong trước đang chờ nửa còn lại
+        halves: Dict[Tuple[int, int], Tuple[Tuple[int, int], Optional[int]]] = {}
+        first_half: Dict[Tuple[int, int], Optional[Tuple[Tuple[int, int], Dict]]] = {}
+
+        def bisect(batch_range: Tuple[int, int], result: Dict):
+            start, end = batch_range
+            mid = (start + end) // 2
+            retry_ranges.appendleft((mid, end))
+            retry_ranges.appendleft((start, mid))
+            halves[(start, mid)] = halves[(mid, end)] = (batch_range, result.get("code"))
+            progress_callback(state["done"], total_records,
+                              f"Dòng {start + 1:,}-{end:,}: Lỗi - {result.get('msg', result.get('exception'))}, "
+                              f"chia đôi để gửi lại")
+
+        def finish(batch_range: Tuple[int, int], result: Dict):
+            start, end = batch_range
+            result["rows"] = [start, end]
+            results.append(result)
+            state["done"] += end - start
+            for i in range(start, end):
+                encoded[i] = None
+            if on_batch_done is not None:
+                on_batch_done(start, end, result)
+            label = f"Dòng {start + 1:,}-{end:,}"
+            if result["status"] == "success":
+                message = f"{label}: {action} thành công {end - start} bản ghi"
+            else:
+                message = f"{label}: Lỗi - {result.get('msg', result.get('exception'))}"
+            progress_callback(state["done"], total_records, message)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+            try:
+                while True:
+                    while len(pending) < max_workers:
+                        batch_range = next_range()
+                        if batch_range is None:
+                            break
+                        start, end = batch_range
+                        body = b'{"records":[' + b','.join(encoded[start:end]) + b']}'
+                        future = executor.submit(self._send_batch, url, body, state["sent"], count_key, idempotent)
+                        pending[future] = batch_range
+                        state["sent"] += 1
+                        state["bytes"] += len(body)
+                    if not pending:
+                        break
+
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        batch_range = pending.pop(future)
+                        start, end = batch_range
+                        result = future.result()
+                        sizer.observe(result, end - start)
+                        can_split = result["status"] != "success" and end - start > 1 and self._should_bisect(result)
+
+                        parent = halves.pop(batch_range, None)
+                        if parent is None:
+                            (bisect if can_split else finish)(batch_range, result)
+                            continue
+                        # Nửa lỗi cùng mã với batch cha chờ nửa còn lại: nếu cả hai nửa đều vậy thì lỗi không nằm
+                        # ở vài dòng (schema, quyền... chưa có trong NON_BISECT_CODES), dừng chia thay vì chia tới
+                        # từng dòng (~2N-1 request)
+                        parent_range, parent_code = parent
+                        same_error = (can_split and result.get("code") == parent_code
+                                      and parent_code not in self.ROW_DATA_ERROR_CODES)
+                        if parent_range not in first_half:
+                            first_half[parent_range] = (batch_range, result) if same_error else None
+                            if not same_error:
+                                (bisect if can_split else finish)(batch_range, result)
+                            continue
+                        waiting = first_half.pop(parent_range)
+                        if waiting is not None and same_error:
+                            finish(*waiting)
+                            finish(batch_range, result)
+                            continue
+                        if waiting is not None:
+                            bisect(*waiting)
+                        (bisect if can_split else finish)(batch_range, result)
+            except BaseException:
+                # Hủy job (SyncJobCancelled từ progress_callback) hoặc lỗi khác: không gửi thêm batch, nhưng các
+                # batch đang gửi vẫn có thể đã được ghi trên Larkbase (batch_create không idempotent). Chờ chúng
+                # xong và báo qua on_batch_done (checkpoint) trước khi dừng để lần tiếp tục không tạo trùng
+                progress_callback = no_progress
+                for future in list(pending):
+                    finish(pending.pop(future), future.result())
+                for waiting in first_half.values():
+                    if waiting is not None:
+                        finish(*waiting)
+                raise
+
+        results.sort(key=lambda r: r["rows"][0])
+        for i, result in enumerate(results):
+            result["batch"] = i + 1
+        note_phase(rows=sum(r["rows"][1] - r["rows"][0] for r in results if r["status"] == "success"),
+                   num_bytes=state["bytes"])
+        return results
+
+    def _batch_sizer(self, count_key: str, max_batch_size: int) -> AdaptiveBatchSizer:
+        """Mỗi loại thao tác (tạo/cập nhật/xóa) có kích thước batch thích ứng riêng, giữ qua các lần gọi"""
+        sizer = self._sizers.get(count_key)
+        if sizer is None or sizer.max_records != max_batch_size:
+            sizer = self._sizers[count_key] = AdaptiveBatchSizer(max_batch_size)
+        return sizer
+
+    def _should_bisect(self, result: Dict) -> bool:
+        """Chỉ chia đôi khi payload quá lớn (413) hoặc lỗi dữ liệu 4xx có thể do một vài dòng.
+        Lỗi 5xx, timeout, lỗi kết nối không chia đôi: batch có thể đã được ghi (batch_create không idempotent),
+        gửi lại hai nửa sẽ tạo trùng"""
+        status_code = result.get("status_code")
+        if status_code == 413:
+            return True
+        code = result.get("code")
+        return (code is not None and status_code is not None and 400 <= status_code < 500
+                and code not in self.NON_BISECT_CODES)
+
+    @staticmethod
+    def _format_batch(batch: List[Dict]) -> List[Dict]:
+        """Chuẩn bị dữ liệu cho API Larkbase"""
+        formatted_batch = []
+        for record in batch:
+            formatted_record = {"fields": {}}
+            for key, value in record.items():
+                # Chuyển đổi giá trị thành format phù hợp với Larkbase
+                if pd.isna(value):
+                    formatted_record["fields"][key] = ""
+                elif isinstance(value, (int, float)):
+                    formatted_record["fields"][key] = value
+                else:
+                    formatted_record["fields"][key] = str(value)
+            formatted_batch.append(formatted_record)
+        return formatted_batch
+
+    def _send_batch(self, url: str, body: bytes, batch_index: int, count_key: str, idempotent: bool) -> Dict:
+        """Gửi một batch (body JSON đã serialize) trong worker thread, không gọi Streamlit"""
+        started = time.monotonic()
+        try:
+            response = self._request('POST', url, idempotent=idempotent, data=body)
+        except Exception as e:
+            return {
+                "status": "error",
+                "batch": batch_index + 1,
+                "exception": str(e),
+                "latency": time.monotonic() - started
+            }
+        # Chỉ tính thời gian server xử lý lần gửi cuối (response.elapsed: từ lúc gửi tới khi nhận header),
+        # không gồm thời gian chờ rate governor và retry sau 429: batch size phản ánh tốc độ server,
+        # không thu nhỏ batch (và tăng số request) khi job đang bị giới hạn theo QPS
+        latency = response.elapsed.total_seconds()
+
+        try:
+            res_json = response.json()
+            if res_json.get('code') == 0:
+                records = res_json['data']['records']
+                return {
+                    "status": "success", 
+                    "batch": batch_index + 1, 
+                    count_key: len(records),
+                    "record_ids": [record.get('record_id') for record in records],
+                    "status_code": response.status_code,
+                    "latency": latency
+                }
+            return {
+                "status": "error", 
+                "batch": batch_index + 1, 
+                "msg": res_json.get('msg'), 
+                "code": res_json.get('code'),
+                "status_code": response.status_code,
+                "latency": latency
+            }
+        except Exception as e:
+            return {
+                "status": "error", 
+                "batch": batch_index + 1, 
+                "status_code": response.status_code, 
+                "exception": str(e),
+                "latency": latency
+            }
+
+    @instrumented("larkbase_sync_by_key")
+    def sync_records_by_key(self, records: Union[pd.DataFrame, List[Dict]], key_columns: List[str], app_token: str,
+                            table_id: str, delete_missing: bool = True, max_workers: Optional[int] = None,
+                            progress_callback: Optional[Callable[[int, int, str], None]] = None) -> Dict:
+        """Đồng bộ theo cột khóa: chỉ tạo/cập nhật/xóa những record thực sự thay đổi"""
+        if isinstance(records, pd.DataFrame):
+            columns = [str(col) for col in records.columns]
+            payload = self.get_formatter(app_token, table_id).format_dataframe(records)
+        else:
+            columns = list(records[0].keys()) if records else list(key_columns)
+            payload = self._format_batch(records)
+        existing = self.list_records(app_token, table_id, field_names=columns)
+
+        # Index records hiện có theo khóa (một khóa có thể trùng nhiều record)
+        existing_by_key: Dict[tuple, List[Dict]] = {}
+        for record in existing:
+            fields = record.get('fields') or {}
+            key = tuple(_normalize_field_value(fields.get(col)) for col in key_columns)
+            existing_by_key.setdefault(key, []).append(record)
+
+        to_create, to_update = [], []
+        # Vị trí dòng nguồn của từng record cần tạo/cập nhật, để báo lỗi theo dòng của kết quả query
+        create_positions, update_positions = [], []
+        unchanged = 0
+        for position, formatted in enumerate(payload):
+            fields = formatted["fields"]
+            key = tuple(_normalize_field_value(fields.get(col)) for col in key_columns)
+            matches = existing_by_key.get(key)
+            if not matches:
+                to_create.append(formatted)
+                create_positions.append(position)
+                continue
+
+            current = matches.pop(0)
+            current_fields = current.get('fields') or {}
+            if _content_hash(fields, columns) == _content_hash(current_fields, columns):
+                unchanged += 1
+            else:
+                to_update.append({"record_id": current['record_id'], "fields": fields})
+                update_positions.append(position)
+
+        # Record còn lại trong index không còn xuất hiện trong dữ liệu mới
+        to_delete = [record['record_id'] for matches in existing_by_key.values() for record in matches]
+        if not delete_missing:
+            to_delete = []
+
+        summary = {
+            "existing": len(existing),
+            "created": len(to_create),
+            "updated": len(to_update),
+            "deleted": len(to_delete),
+            "unchanged": unchanged,
+            "create_results": [],
+            "update_results": [],
+            "delete_result": None
+        }
+        if to_create:
+            summary["create_results"] = self._create_payload(to_create, app_token, table_id, max_workers=max_workers,
+                                                             progress_callback=progress_callback)
+            _to_source_rows(summary["create_results"], create_positions, "create")
+        if to_update:
+            summary["update_results"] = self.batch_update_records(to_update, app_token, table_id, max_workers=max_workers,
+                                                                  progress_callback=progress_callback)
+            _to_source_rows(summary["update_results"], update_positions, "update")
+        if to_delete:
+            summary["delete_result"] = self.batch_delete_records(to_delete, app_token, table_id, max_workers=max_workers,
+                                                                 progress_callback=progress_callback)
+        return summary
+
+def _to_source_rows(results: List[Dict], positions: List[int], action: str):
+    """Đổi "rows" của kết quả batch từ vị trí trong danh sách cần tạo/cập nhật sang dòng nguồn
+    (dòng đầu tới dòng cuối của batch; các dòng không đổi nằm giữa không được gửi) và ghi loại thao tác"""
+    for result in results:
+        if "rows" in result:
+            start, end = result["rows"]
+            result["rows"] = [positions[start], positions[end - 1] + 1]
+        result["action"] = action
+
+def _normalize_field_value(value) -> str:
+    """Đưa giá trị field (từ DataFrame hoặc API Larkbase) về chuỗi chuẩn để so sánh"""
+    if value is None or value is False:
+        # Lark bỏ qua field rỗng và checkbox chưa chọn khi trả về record
+        return ""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, (int, float)):
+        # 5, 5.0 và "5" được coi là cùng một giá trị
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+    if isinstance(value, dict):
+        # Field URL / link trả về dạng {"text": ..., "link": ...}
+        return str(value.get('text', value))
+    if isinstance(value, list):
+        # Field text trả về dạng [{"type": "text", "text": ...}], multi-select dạng ["a", "b"]
+        parts = [item.get('text', '') if isinstance(item, dict) else str(item) for item in value]
+        joiner = "" if value and isinstance(value[0], dict) else ","
+        return joiner.join(parts)
+    return str(value)
+
+def _content_hash(fields: Dict, columns: List[str]) -> str:
+    """Hash nội dung các cột để phát hiện record thay đổi"""
+    normalized = {col: _normalize_field_value(fields.get(col)) for col in columns}
+    return hashlib.md5(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+def no_progress(done: int, total: int, message: str):
+    """Progress callback mặc định: không hiển thị gì"""
@@ -0,0 +1,225 @@
+"""Metrics dùng chung cho app Streamlit và job chạy headless: counter/histogram theo label,
+đo thời gian theo phase kèm structured log, và endpoint Prometheus"""
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class MetricsRegistry:
+    """Counter/histogram/gauge theo label, thread-safe; xuất ra định dạng text của Prometheus"""
+
+    DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+    def __init__(self, prefix: str = "bq2lark"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+        # Mỗi histogram: label -> [số đếm theo bucket..., sum, count]
+        self._histograms: Dict[str, Dict[Tuple, List[float]]] = {}
+        self._gauges: Dict[str, Callable[[], List[Tuple[Dict, float]]]] = {}
+        self._help: Dict[str, str] = {}
+
+    def inc(self, name: str, value: float = 1.0, description: str = "", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+            self._help.setdefault(name, description)
+
+    def observe(self, name: str, value: float, description: str = "", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            values = series.get(key)
+            if values is None:
+                values = series[key] = [0.0] * (len(self.DEFAULT_BUCKETS) + 2)
+            for i, bound in enumerate(self.DEFAULT_BUCKETS):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+            self._help.setdefault(name, description)
+
+    def register_gauge(self, name: str, collect: Callable[[], List[Tuple[Dict, float]]], description: str = ""):
+        """Gauge được đọc lúc xuất metrics: collect() trả về danh sách (labels, value)"""
+        with self._lock:
+            self._gauges[name] = collect
+            self._help[name] = description
+
+    def histogram_summary(self, name: str) -> List[Dict]:
+        """Tóm tắt histogram theo label: số lần, tổng, trung bình, p50/p99 (ước lượng từ bucket)"""
+        with self._lock:
+            series = {key: list(values) for key, values in self._histograms.get(name, {}).items()}
+        summary = []
+        for key, values in series.items():
+            count = values[-1]
+            summary.append({
+                **dict(key),
+                "count": int(count),
+                "sum": values[-2],
+                "avg": values[-2] / count if count else 0.0,
+                "p50": self._quantile(values, 0.5),
+                "p99": self._quantile(values, 0.99)
+            })
+        return summary
+
+    def counter_values(self, name: str) -> List[Dict]:
+        with self._lock:
+            return [{**dict(key), "value": value} for key, value in self._counters.get(name, {}).items()]
+
+    def _quantile(self, values: List[float], q: float) -> float:
+        count = values[-1]
+        if not count:
+            return 0.0
+        rank = q * count
+        lower, previous = 0.0, 0.0
+        for i, bound in enumerate(self.DEFAULT_BUCKETS):
+            if values[i] >= rank:
+                # Nội suy tuyến tính trong bucket chứa quantile
+                in_bucket = values[i] - previous
+                return lower + (bound - lower) * ((rank - previous) / in_bucket if in_bucket else 1.0)
+            lower, previous = bound, values[i]
+        return self.DEFAULT_BUCKETS[-1]
+
+    def render(self) -> str:
+        """Xuất toàn bộ metrics theo Prometheus text exposition format 0.0.4"""
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {k: list(v) for k, v in series.items()} for name, series in self._histograms.items()}
+            gauges = dict(self._gauges)
+            helps = dict(self._help)
+
+        lines = []
+        for name, series in counters.items():
+            lines += self._header(name, helps, "counter")
+            lines += [f"{self.prefix}_{name}{self._labels(dict(key))} {value}" for key, value in series.items()]
+        for name, series in histograms.items():
+            lines += self._header(name, helps, "histogram")
+            for key, values in series.items():
+                labels = dict(key)
+                for i, bound in enumerate(self.DEFAULT_BUCKETS):
+                    lines.append(f"{self.prefix}_{name}_bucket{self._labels({**labels, 'le': bound})} {values[i]}")
+                lines.append(f"{self.prefix}_{name}_bucket{self._labels({**labels, 'le': '+Inf'})} {values[-1]}")
+                lines.append(f"{self.prefix}_{name}_sum{self._labels(labels)} {values[-2]}")
+                lines.append(f"{self.prefix}_{name}_count{self._labels(labels)} {values[-1]}")
+        for name, collect in gauges.items():
+            lines += self._header(name, helps, "gauge")
+            try:
+                lines += [f"{self.prefix}_{name}{self._labels(labels)} {value}" for labels, value in collect()]
+            except Exception as e:
+                logger.warning("Không đọc được gauge %s: %s", name, e)
+        return "\n".join(lines) + "\n"
+
+    def _header(self, name: str, helps: Dict[str, str], kind: str) -> List[str]:
+        header = [f"# HELP {self.prefix}_{name} {helps[name]}"] if helps.get(name) else []
+        return header + [f"# TYPE {self.prefix}_{name} {kind}"]
+
+    @staticmethod
+    def _labels(labels: Dict) -> str:
+        if not labels:
+            return ""
+
+        def escape(value) -> str:
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+# Log có cấu trúc (JSON mỗi dòng trên stdout) để Cloud Logging tự parse thành jsonPayload
+metrics_logger = logging.getLogger("bq2lark.metrics")
+if not metrics_logger.handlers:
+    _metrics_handler = logging.StreamHandler(sys.stdout)
+    _metrics_handler.setFormatter(logging.Formatter("%(message)s"))
+    metrics_logger.addHandler(_metrics_handler)
+    metrics_logger.setLevel(logging.INFO)
+    metrics_logger.propagate = False
+
+_phase_local = threading.local()
+
+@contextmanager
+def track_phase(metrics: Optional[MetricsRegistry], phase: str, **fields):
+    """Đo một phase (thời gian, số dòng, bytes) và ghi vào metrics + structured log.
+    Code bên trong cộng dồn số dòng/bytes bằng note_phase()"""
+    stats = {"rows": 0, "bytes": 0}
+    stack = getattr(_phase_local, "stack", None)
+    if stack is None:
+        stack = _phase_local.stack = []
+    stack.append(stats)
+    started = time.monotonic()
+    status = "ok"
+    try:
+        yield stats
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        stack.pop()
+        duration = time.monotonic() - started
+        if metrics is not None:
+            metrics.observe("phase_duration_seconds", duration, "Thời gian mỗi phase", phase=phase, status=status)
+            if stats["rows"]:
+                metrics.inc("phase_rows_total", stats["rows"], "Số dòng xử lý theo phase", phase=phase)
+            if stats["bytes"]:
+                metrics.inc("phase_bytes_total", stats["bytes"], "Số bytes xử lý theo phase", phase=phase)
+        log_event("phase", f"phase {phase} {status} in {duration:.3f}s", "INFO" if status == "ok" else "WARNING",
+                  phase=phase, status=status, duration_seconds=round(duration, 4), rows=stats["rows"],
+                  bytes=stats["bytes"], **fields)
+
+def log_event(event: str, message: str, severity: str = "INFO", **fields):
+    """Ghi một dòng structured log (JSON) vào metrics_logger"""
+    metrics_logger.info(json.dumps({
+        "severity": severity,
+        "message": message,
+        "event": event,
+        **fields
+    }, ensure_ascii=False, default=str))
+
+def note_phase(rows: int = 0, num_bytes: int = 0):
+    """Cộng số dòng/bytes vào phase trong cùng nhất đang chạy trên thread hiện tại"""
+    stack = getattr(_phase_local, "stack", None)
+    if stack:
+        stack[-1]["rows"] += rows
+        stack[-1]["bytes"] += num_bytes
+
+def instrumented(phase: str):
+    """Decorator cho method của các lớp Larkbase: đo phase bằng registry self.metrics"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with track_phase(getattr(self, "metrics", None), phase):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def serve_metrics(registry: MetricsRegistry, port: int, host: str = '0.0.0.0') -> Optional[ThreadingHTTPServer]:
+    """Mở endpoint /metrics (Prometheus) trong thread nền; trả về None nếu không mở được cổng.
+    Cloud Run chỉ route cổng chính, nên endpoint này dành cho sidecar thu thập metrics trong cùng instance"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    except OSError as e:
+        logger.error("Không mở được metrics endpoint trên cổng %s: %s", port, e)
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Metrics endpoint: http://%s:%s/metrics", host, port)
+    return server
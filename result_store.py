@@ -0,0 +1,249 @@
+"""Lưu kết quả query của các session dạng cột (Arrow) thay cho DataFrame trong session_state.
+Cột chuỗi lặp nhiều được mã hóa dictionary, cột số nguyên thu về kiểu nhỏ nhất đủ chứa; khi vượt ngân sách
+bộ nhớ, kết quả ít dùng nhất được ghi ra file Arrow IPC và đọc lại bằng memory-map. Không phụ thuộc Streamlit"""
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+class ResultEvicted(Exception):
+    """Kết quả đã bị xóa khỏi store (session lâu không hoạt động hoặc đã có kết quả mới)"""
+
+# Cột chuỗi có tỉ lệ giá trị khác nhau không quá ngưỡng này thì được mã hóa dictionary
+DICTIONARY_MAX_UNIQUE_RATIO = 0.5
+
+def compact_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """Bản sao gọn của DataFrame trước khi chuyển sang Arrow: chuỗi lặp nhiều -> category (dictionary),
+    số nguyên -> kiểu nhỏ nhất đủ chứa. Số thực giữ nguyên để không mất độ chính xác khi ghi sang Larkbase"""
+    columns = {}
+    for name in df.columns:
+        series = df[name]
+        if pd.api.types.is_integer_dtype(series.dtype):
+            series = pd.to_numeric(series, downcast="integer")
+        elif series.dtype == object and len(series) and pd.api.types.infer_dtype(series, skipna=True) == "string":
+            if series.nunique(dropna=True) <= len(series) * DICTIONARY_MAX_UNIQUE_RATIO:
+                series = series.astype("category")
+        columns[name] = series
+    return pd.DataFrame(columns, index=pd.RangeIndex(len(df)))
+
+class ResultHandle:
+    """Handle nhẹ của một kết quả query, được giữ trong session_state thay cho dữ liệu"""
+
+    def __init__(self, result_id: str, owner: str, num_rows: int, columns: List[str], nbytes: int,
+                 attrs: Optional[Dict] = None):
+        self.result_id = result_id
+        self.owner = owner
+        # Thông tin hiển thị được tính một lần khi lưu kết quả, không phải quét lại dữ liệu mỗi lần chạy script
+        self.num_rows = num_rows
+        self.columns = columns
+        # Dung lượng dạng Arrow (sau khi nén dictionary/thu nhỏ kiểu)
+        self.nbytes = nbytes
+        # df.attrs của kết quả gốc (cache_hit, destination của query BigQuery)
+        self.attrs = attrs or {}
+        self.created_at = time.time()
+
+    def page_count(self, page_size: int) -> int:
+        return math.ceil(self.num_rows / page_size)
+
+class _StoredResult:
+    def __init__(self, handle: ResultHandle, table: pa.Table, dtypes: Dict[str, object]):
+        self.handle = handle
+        self.table = table
+        # Kiểu dữ liệu gốc của từng cột, để trả lại DataFrame giống kết quả BigQuery
+        self.dtypes = dtypes
+        self.path: Optional[str] = None
+        self.spilling = False
+        # File dẫn xuất từ kết quả (ví dụ file export) theo khóa, bị xóa cùng kết quả
+        self.artifacts: Dict[str, str] = {}
+        self.last_access = time.time()
+
+    @property
+    def in_memory(self) -> bool:
+        return self.path is None
+
+class SessionResultStore:
+    """Kết quả query của mọi session trên instance: mỗi owner (session) giữ một kết quả, kết quả của session
+    không hoạt động quá idle_ttl giây bị xóa, tổng dung lượng trong RAM giữ dưới memory_budget"""
+
+    def __init__(self, spill_dir: Optional[str] = None, memory_budget: Optional[int] = None,
+                 idle_ttl: Optional[int] = None):
+        # Thư mục riêng cho mỗi instance: handle không sống qua lần khởi động lại nên không đọc lại file cũ
+        self.spill_dir = os.path.join(
+            spill_dir or os.getenv('RESULT_STORE_DIR', os.path.join(tempfile.gettempdir(), 'bq_session_results')),
+            uuid.uuid4().hex[:12]
+        )
+        self.memory_budget = int(memory_budget or os.getenv('RESULT_STORE_MEMORY_BUDGET', 256 * 1024 * 1024))
+        self.idle_ttl = int(idle_ttl or os.getenv('RESULT_STORE_IDLE_TTL', 1800))
+        # result_id -> kết quả, theo thứ tự truy cập (cuối = mới dùng nhất)
+        self._results: "OrderedDict[str, _StoredResult]" = OrderedDict()
+        self._by_owner: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+    def put(self, owner: str, df: pd.DataFrame) -> ResultHandle:
+        """Lưu kết quả mới của owner (thay kết quả cũ) và trả về handle"""
+        table = pa.Table.from_pandas(compact_dataframe(df), preserve_index=False)
+        handle = ResultHandle(uuid.uuid4().hex[:16], owner, len(df), [str(c) for c in df.columns], table.nbytes,
+                              dict(df.attrs))
+        stored = _StoredResult(handle, table, {str(c): df[c].dtype for c in df.columns})
+        with self._lock:
+            previous = self._by_owner.get(owner)
+            if previous:
+                self._drop(previous)
+            self._results[handle.result_id] = stored
+            self._by_owner[owner] = handle.result_id
+        self.evict()
+        return handle
+
+    def get_table(self, handle: Optional[ResultHandle]) -> Optional[pa.Table]:
+        """Bảng Arrow của kết quả (None nếu đã bị xóa do session không hoạt động)"""
+        self.evict()
+        stored = self._touch(handle)
+        return stored.table if stored is not None else None
+
+    def to_pandas(self, handle: Optional[ResultHandle], start: int = 0,
+                  stop: Optional[int] = None) -> Optional[pd.DataFrame]:
+        """DataFrame các dòng [start, stop) với kiểu dữ liệu như kết quả gốc; chỉ phần được đọc mới được giải nén"""
+        self.evict()
+        stored = self._touch(handle)
+        if stored is None:
+            return None
+        stop = stored.handle.num_rows if stop is None else min(stop, stored.handle.num_rows)
+        start = min(max(start, 0), stop)
+        df = stored.table.slice(start, stop - start).to_pandas()
+        for column, dtype in stored.dtypes.items():
+            if df[column].dtype != dtype:
+                df[column] = df[column].astype(dtype)
+        df.index = pd.RangeIndex(start, stop)
+        return df
+
+    def iter_frames(self, handle: Optional[ResultHandle], chunk_rows: int) -> Iterator[pd.DataFrame]:
+        """Đọc lần lượt từng đoạn chunk_rows dòng (mỗi lần chỉ giải nén một đoạn)"""
+        for start in range(0, handle.num_rows if handle is not None else 0, chunk_rows):
+            df = self.to_pandas(handle, start, start + chunk_rows)
+            if df is None:
+                raise ResultEvicted(handle.result_id)
+            yield df
+
+    def get_artifact(self, handle: Optional[ResultHandle], key: str) -> Optional[str]:
+        """Đường dẫn file dẫn xuất đã tạo cho kết quả (None nếu chưa có)"""
+        stored = self._touch(handle)
+        if stored is None:
+            return None
+        path = stored.artifacts.get(key)
+        return path if path and os.path.exists(path) else None
+
+    def artifact_path(self, handle: ResultHandle, key: str) -> str:
+        return os.path.join(self.spill_dir, f"{handle.result_id}.{key}")
+
+    def put_artifact(self, handle: ResultHandle, key: str, path: str) -> bool:
+        """Gắn file dẫn xuất vào kết quả; trả về False (và xóa file) nếu kết quả đã bị xóa"""
+        with self._lock:
+            stored = self._results.get(handle.result_id)
+            if stored is not None:
+                stored.artifacts[key] = path
+                return True
+        self._remove(path)
+        return False
+
+    def release(self, owner: str):
+        """Xóa kết quả của owner"""
+        with self._lock:
+            result_id = self._by_owner.get(owner)
+            if result_id:
+                self._drop(result_id)
+
+    def _touch(self, handle: Optional[ResultHandle]) -> Optional[_StoredResult]:
+        if handle is None:
+            return None
+        with self._lock:
+            stored = self._results.get(handle.result_id)
+            if stored is not None:
+                stored.last_access = time.time()
+                self._results.move_to_end(handle.result_id)
+            return stored
+
+    def _drop(self, result_id: str):
+        """Gọi khi đang giữ lock"""
+        stored = self._results.pop(result_id, None)
+        if stored is None:
+            return
+        if self._by_owner.get(stored.handle.owner) == result_id:
+            del self._by_owner[stored.handle.owner]
+        # Trên Linux file đã mở bằng memory-map vẫn đọc được tới khi bảng cuối cùng được giải phóng
+        for path in [stored.path, *stored.artifacts.values()]:
+            if path:
+                self._remove(path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Xóa kết quả của session không hoạt động, sau đó chuyển kết quả ít dùng nhất ra file memory-map
+        cho tới khi phần giữ trong RAM không vượt memory_budget"""
+        now = time.time()
+        with self._lock:
+            for result_id, stored in list(self._results.items()):
+                if now - stored.last_access > self.idle_ttl:
+                    self._drop(result_id)
+            in_memory = [(result_id, stored) for result_id, stored in self._results.items() if stored.in_memory]
+            total = sum(stored.table.nbytes for _, stored in in_memory)
+            victims = []
+            for result_id, stored in in_memory:
+                if total <= self.memory_budget:
+                    break
+                total -= stored.table.nbytes
+                # Kết quả đang được thread khác ghi ra file thì không ghi lại
+                if not stored.spilling:
+                    stored.spilling = True
+                    victims.append((result_id, stored))
+
+        # Ghi file ngoài lock để không chặn các session khác
+        for result_id, stored in victims:
+            self._spill(result_id, stored)
+
+    def _spill(self, result_id: str, stored: _StoredResult):
+        path = os.path.join(self.spill_dir, f"{result_id}.arrow")
+        try:
+            with pa.OSFile(path, "wb") as sink:
+                with pa.ipc.new_file(sink, stored.table.schema) as writer:
+                    writer.write_table(stored.table)
+            table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        except Exception as e:
+            logger.warning("Không ghi được kết quả %s ra đĩa: %s", result_id, e)
+            self._remove(path)
+            stored.spilling = False
+            return
+        with self._lock:
+            if self._results.get(result_id) is not stored:
+                # Kết quả đã bị thay thế/xóa trong lúc ghi file
+                self._remove(path)
+                return
+            stored.table = table
+            stored.path = path
+
+    def stats(self) -> Dict:
+        with self._lock:
+            results = list(self._results.values())
+        return {
+            "results": len(results),
+            "rows": sum(r.handle.num_rows for r in results),
+            "memory_bytes": sum(r.table.nbytes for r in results if r.in_memory),
+            "spilled_bytes": sum(r.table.nbytes for r in results if not r.in_memory),
+            "artifacts": sum(len(r.artifacts) for r in results),
+            "memory_budget": self.memory_budget
+        }
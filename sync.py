@@ -0,0 +1,502 @@
+"""Đồng bộ BigQuery → Larkbase: streaming theo trang, job chạy nền có thể hủy và checkpoint trên đĩa
+để tiếp tục job bị lỗi. Không phụ thuộc Streamlit nên dùng được cho cả app và job headless (cli.py)"""
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from bigquery_utils import STREAM_PAGE_SIZE, list_bigquery_rows, stream_bigquery_query, table_exists
+from larkbase import LarkbaseApiError, LarkbaseRecordManager, no_progress
+from metrics import note_phase, track_phase
+
+logger = logging.getLogger(__name__)
+
+# Các chế độ ghi dữ liệu vào Larkbase
+SYNC_MODES = {
+    "replace": "🗑️ Xóa tất cả dữ liệu cũ rồi ghi mới",
+    "append": "➕ Giữ dữ liệu cũ, chỉ thêm mới",
+    "upsert": "🔑 Đồng bộ theo cột khóa (chỉ ghi phần thay đổi)"
+}
+
+def stream_query_to_larkbase(query: str, record_manager: LarkbaseRecordManager, app_token: str, table_id: str,
+                             page_size: int = STREAM_PAGE_SIZE,
+                             progress_callback: Optional[Callable[[int, int, str], None]] = None,
+                             client=None, checkpoint: Optional["SyncCheckpoint"] = None) -> Dict:
+    """Tải kết quả BigQuery theo từng trang và ghi vào Larkbase; trang kế tiếp được tải trong lúc ghi trang hiện tại.
+    Khi có checkpoint, các dòng đã ghi được bỏ qua và job tiếp tục đọc từ bảng kết quả tạm của lần chạy trước"""
+    if progress_callback is None:
+        progress_callback = no_progress
+
+    metrics = record_manager.metrics
+    start_index = 0
+    if checkpoint is not None and checkpoint.meta.get("destination"):
+        if not table_exists(checkpoint.meta["destination"], client):
+            raise RuntimeError("Bảng kết quả tạm của lần chạy trước đã hết hạn (BigQuery chỉ giữ khoảng 24 giờ), "
+                               "không thể tiếp tục: hãy bỏ checkpoint này và chạy lại đồng bộ")
+        start_index = checkpoint.first_pending_row()
+        total_rows, chunks = list_bigquery_rows(checkpoint.meta["destination"], start_index, page_size, client)
+    else:
+        with track_phase(metrics, "bq_query"):
+            total_rows, chunks, destination = stream_bigquery_query(query, page_size, client)
+        if checkpoint is not None:
+            checkpoint.update(destination=destination, total_rows=total_rows)
+
+    # Thread tải dữ liệu chạy trước tối đa 2 trang để giới hạn bộ nhớ
+    buffer: queue.Queue = queue.Queue(maxsize=2)
+    stop = threading.Event()
+    done_marker = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def download():
+        try:
+            pages = iter(chunks)
+            while True:
+                # Chỉ đo thời gian tải từng trang, không tính thời gian chờ khi buffer đầy
+                with track_phase(metrics, "bq_download"):
+                    chunk = next(pages, None)
+                    if chunk is not None:
+                        note_phase(rows=len(chunk), num_bytes=int(chunk.memory_usage(deep=True).sum()))
+                if chunk is None or not put(chunk):
+                    break
+            put(done_marker)
+        except Exception as e:
+            put(e)
+
+    downloader = threading.Thread(target=download, daemon=True)
+    downloader.start()
+
+    formatter = record_manager.get_formatter(app_token, table_id)
+    results: List[Dict] = []
+    rows_done = 0
+    written = 0
+    try:
+        while True:
+            chunk = buffer.get()
+            if chunk is done_marker:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            if chunk.empty:
+                continue
+
+            # Vị trí tuyệt đối của các dòng trong kết quả query, bỏ qua dòng đã ghi ở lần chạy trước
+            chunk_start, chunk_rows = start_index + rows_done, len(chunk)
+            positions = np.arange(chunk_start, chunk_start + chunk_rows)
+            rows_done += chunk_rows
+            if checkpoint is not None:
+                pending = checkpoint.pending_mask(positions)
+                chunk, positions = chunk[pending], positions[pending]
+                if chunk.empty:
+                    continue
+
+            def chunk_progress(done: int, total: int, message: str, chunk_start=chunk_start, chunk_rows=chunk_rows):
+                rows = chunk_start + chunk_rows * done // total
+                progress_callback(rows, max(total_rows, rows), f"{rows:,}/{total_rows:,} dòng - {message}")
+
+            def batch_done(start: int, end: int, result: Dict, positions=positions):
+                if checkpoint is not None and result["status"] == "success":
+                    checkpoint.record_rows(positions[start:end], result.get("record_ids", []))
+
+            batch_offset = len(results)
+            chunk_results = record_manager._create_payload(
+                formatter.format_dataframe(chunk), app_token, table_id,
+                progress_callback=chunk_progress, on_batch_done=batch_done
+            )
+            for result in chunk_results:
+                result["batch"] = result["batch"] + batch_offset
+                _to_absolute_rows(result, positions)
+            results.extend(chunk_results)
+            written += len(chunk)
+    finally:
+        stop.set()
+
+    return {"total_rows": written, "results": results}
+
+class SyncJobCancelled(Exception):
+    """Job đồng bộ bị người dùng hủy"""
+
+class SyncJob:
+    """Một lần đồng bộ chạy nền: trạng thái, tiến độ và handle để hủy"""
+
+    FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+    def __init__(self, description: str, owner: Optional[str] = None, job_id: Optional[str] = None):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.description = description
+        self.owner = owner
+        self.status = "queued"
+        self.phase = ""
+        self.done = 0
+        self.total = 0
+        self.message = ""
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in self.FINISHED_STATUSES
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    @property
+    def progress(self) -> float:
+        return min(self.done / self.total, 1.0) if self.total else 0.0
+
+    def cancel(self):
+        """Yêu cầu hủy; job dừng sau batch đang gửi"""
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise SyncJobCancelled()
+
+    def set_phase(self, phase: str):
+        self.check_cancelled()
+        self.phase = phase
+        self.done, self.total, self.message = 0, 0, ""
+
+    def update(self, done: int, total: int, message: str):
+        """Progress callback (done, total, message) truyền cho LarkbaseRecordManager"""
+        self.done, self.total, self.message = done, total, message
+        self.check_cancelled()
+
+class SyncJobManager:
+    """Chạy các job đồng bộ trong thread pool riêng, không bị dừng khi Streamlit chạy lại script"""
+
+    def __init__(self, max_workers: Optional[int] = None, retention: int = 3600):
+        self.max_workers = int(max_workers or os.getenv('SYNC_JOB_WORKERS', 4))
+        # Job đã kết thúc được giữ lại retention giây để người dùng xem kết quả
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sync-job')
+        self._jobs: Dict[str, SyncJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job: SyncJob, fn: Callable[[SyncJob], Dict]) -> SyncJob:
+        self._prune()
+        with self._lock:
+            self._jobs[job.job_id] = job
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id: str) -> Optional[SyncJob]:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self, owner: Optional[str] = None) -> List[SyncJob]:
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if owner is None or job.owner == owner]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def _run(self, job: SyncJob, fn: Callable[[SyncJob], Dict]):
+        if job.cancel_requested:
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return
+
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = fn(job)
+            job.status = "succeeded"
+        except SyncJobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            logger.exception("Job đồng bộ %s lỗi", job.job_id)
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        now = time.time()
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.is_finished and now - job.finished_at > self.retention:
+                    del self._jobs[job_id]
+
+class SyncCheckpoint:
+    """Tiến độ của một job đồng bộ lưu trên đĩa: tham số, ảnh chụp dữ liệu nguồn và các dòng đã ghi xong"""
+
+    def __init__(self, path: str, meta: Dict):
+        self.path = path
+        self.meta = meta
+        self._lock = threading.Lock()
+        # Các khoảng dòng [start, end) đã ghi thành công, đọc lại từ batches.jsonl
+        self.completed: List[List[int]] = []
+        self.record_ids: List[str] = []
+        batches_path = os.path.join(path, "batches.jsonl")
+        if os.path.exists(batches_path):
+            with open(batches_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        batch = json.loads(line)
+                    except ValueError:
+                        # Dòng cuối có thể ghi dở khi process bị dừng đột ngột
+                        continue
+                    self.completed = _merge_ranges(self.completed + batch["rows"])
+                    self.record_ids.extend(batch.get("record_ids", []))
+
+    @property
+    def job_id(self) -> str:
+        return self.meta["job_id"]
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.path, "snapshot.parquet")
+
+    @property
+    def completed_row_count(self) -> int:
+        return sum(end - start for start, end in self.completed)
+
+    def load_snapshot(self) -> Optional[pd.DataFrame]:
+        if not os.path.exists(self.snapshot_path):
+            return None
+        return pd.read_parquet(self.snapshot_path)
+
+    def update(self, **fields):
+        """Cập nhật metadata và ghi lại checkpoint.json (ghi file tạm rồi rename)"""
+        with self._lock:
+            self.meta.update(fields, updated_at=time.time())
+            tmp_path = os.path.join(self.path, "checkpoint.json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.meta, f, ensure_ascii=False)
+            os.replace(tmp_path, os.path.join(self.path, "checkpoint.json"))
+
+    def record_rows(self, positions: np.ndarray, record_ids: List[str]):
+        """Ghi nhận một batch đã tạo thành công (vị trí dòng nguồn và record_id được tạo)"""
+        rows = _to_ranges(positions)
+        with self._lock:
+            with open(os.path.join(self.path, "batches.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"rows": rows, "record_ids": record_ids}) + "\n")
+            self.completed = _merge_ranges(self.completed + rows)
+            self.record_ids.extend(record_ids)
+
+    def pending_mask(self, positions: np.ndarray) -> np.ndarray:
+        """Mask các vị trí dòng chưa được ghi"""
+        mask = np.ones(len(positions), dtype=bool)
+        for start, end in self.completed:
+            mask &= (positions < start) | (positions >= end)
+        return mask
+
+    def pending_rows(self, total_rows: int) -> np.ndarray:
+        """Vị trí các dòng chưa được ghi trong tổng số total_rows dòng"""
+        positions = np.arange(total_rows)
+        return positions[self.pending_mask(positions)]
+
+    def delete(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def first_pending_row(self) -> int:
+        """Dòng đầu tiên chưa được ghi (các dòng trước đó đều đã xong)"""
+        if self.completed and self.completed[0][0] == 0:
+            return self.completed[0][1]
+        return 0
+
+def _to_absolute_rows(result: Dict, positions: np.ndarray):
+    """Đổi "rows" của kết quả batch từ vị trí trong payload sang vị trí dòng trong kết quả query"""
+    if "rows" in result:
+        start, end = result["rows"]
+        result["rows"] = [int(positions[start]), int(positions[end - 1]) + 1]
+
+def _to_ranges(positions: np.ndarray) -> List[List[int]]:
+    """Nén danh sách vị trí dòng (đã sắp xếp) thành các khoảng [start, end)"""
+    if len(positions) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(positions)]))
+    return [[int(positions[s]), int(positions[e - 1]) + 1] for s, e in zip(starts, ends)]
+
+def _merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+# Checkpoint của job streaming bị xóa trước khi bảng kết quả tạm của query (giữ 24 giờ) hết hạn
+STREAM_CHECKPOINT_TTL = 23 * 3600
+
+class SyncCheckpointStore:
+    """Lưu checkpoint của các job đồng bộ trên đĩa để tiếp tục job bị lỗi hoặc bị gián đoạn"""
+
+    def __init__(self, base_dir: Optional[str] = None, ttl: Optional[int] = None):
+        self.base_dir = base_dir or os.getenv(
+            'SYNC_CHECKPOINT_DIR', os.path.join(tempfile.gettempdir(), 'larkbase_sync_checkpoints')
+        )
+        # Checkpoint chưa hoàn tất quá ttl giây sẽ bị xóa
+        self.ttl = int(ttl or os.getenv('SYNC_CHECKPOINT_TTL', 7 * 24 * 3600))
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def create(self, job_id: str, params: Dict, df: Optional[pd.DataFrame] = None,
+               owner: Optional[str] = None) -> SyncCheckpoint:
+        """Tạo checkpoint cho job mới, lưu ảnh chụp DataFrame nguồn (nếu có) dạng Parquet"""
+        self.prune()
+        path = os.path.join(self.base_dir, job_id)
+        os.makedirs(path, exist_ok=True)
+        checkpoint = SyncCheckpoint(path, {
+            "job_id": job_id,
+            "owner": owner,
+            "params": params,
+            "status": "queued",
+            "cleared": False,
+            "created_at": time.time()
+        })
+        if df is not None:
+            try:
+                df.to_parquet(checkpoint.snapshot_path, index=False)
+            except Exception as e:
+                # Không lưu được ảnh chụp thì job vẫn chạy, chỉ không tiếp tục được khi lỗi
+                logger.warning("Không lưu được ảnh chụp dữ liệu cho job %s: %s", job_id, e)
+        checkpoint.update()
+        return checkpoint
+
+    def load(self, job_id: str) -> Optional[SyncCheckpoint]:
+        path = os.path.join(self.base_dir, job_id)
+        try:
+            with open(os.path.join(path, "checkpoint.json"), encoding="utf-8") as f:
+                return SyncCheckpoint(path, json.load(f))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def list_incomplete(self, owner: Optional[str] = None) -> List[SyncCheckpoint]:
+        """Các checkpoint chưa hoàn tất (lỗi, bị hủy hoặc bị gián đoạn), chỉ của owner nếu có"""
+        checkpoints = [self.load(job_id) for job_id in os.listdir(self.base_dir)]
+        checkpoints = [
+            c for c in checkpoints
+            if c is not None and c.meta.get("status") != "succeeded" and (owner is None or c.meta.get("owner") == owner)
+        ]
+        return sorted(checkpoints, key=lambda c: c.meta.get("created_at", 0), reverse=True)
+
+    def delete(self, job_id: str):
+        shutil.rmtree(os.path.join(self.base_dir, job_id), ignore_errors=True)
+
+    def prune(self):
+        now = time.time()
+        for checkpoint in self.list_incomplete():
+            expired = now - checkpoint.meta.get("updated_at", 0) > self.ttl
+            if checkpoint.meta["params"].get("stream_sql"):
+                # Job streaming đọc lại bảng kết quả tạm của query, bảng này hết hạn sau khoảng 24 giờ
+                expired = expired or now - checkpoint.meta.get("created_at", 0) > STREAM_CHECKPOINT_TTL
+            if expired:
+                self.delete(checkpoint.job_id)
+
+def run_larkbase_sync(job: SyncJob, record_manager: LarkbaseRecordManager, app_token: str, table_id: str,
+                      sync_mode: str, df: Optional[pd.DataFrame] = None, stream_sql: Optional[str] = None,
+                      key_columns: Optional[List[str]] = None, delete_missing: bool = True,
+                      bigquery_client=None, checkpoint: Optional[SyncCheckpoint] = None) -> Dict:
+    """Chạy một lần đồng bộ sang Larkbase (không gọi Streamlit nên chạy được trong thread nền).
+    Khi có checkpoint, tiến độ được lưu sau mỗi batch và các bước/dòng đã xong ở lần chạy trước được bỏ qua"""
+    if checkpoint is not None:
+        checkpoint.update(status="running", error=None)
+    try:
+        with track_phase(record_manager.metrics, "sync_job", job_id=job.job_id, sync_mode=sync_mode):
+            summary = _run_larkbase_sync(job, record_manager, app_token, table_id, sync_mode, df, stream_sql,
+                                         key_columns, delete_missing, bigquery_client, checkpoint)
+    except SyncJobCancelled:
+        if checkpoint is not None:
+            checkpoint.update(status="cancelled")
+        raise
+    except Exception as e:
+        if checkpoint is not None:
+            checkpoint.update(status="failed", error=str(e))
+        raise
+
+    if checkpoint is not None:
+        if has_failed_batches(summary):
+            # Giữ checkpoint để lần tiếp tục chỉ ghi lại các batch lỗi
+            checkpoint.update(status="incomplete")
+        else:
+            checkpoint.update(status="succeeded")
+            checkpoint.delete()
+    return summary
+
+def has_failed_batches(summary: Dict) -> bool:
+    """Còn batch ghi hoặc xóa (xóa dữ liệu cũ, xóa bản ghi thừa khi upsert) bị lỗi"""
+    cleared = summary.get("cleared")
+    return any(r.get("status") == "error" for r in summary["results"]) or bool(cleared and cleared["error_batches"])
+
+def _run_larkbase_sync(job: SyncJob, record_manager: LarkbaseRecordManager, app_token: str, table_id: str,
+                       sync_mode: str, df: Optional[pd.DataFrame], stream_sql: Optional[str],
+                       key_columns: Optional[List[str]], delete_missing: bool, bigquery_client,
+                       checkpoint: Optional[SyncCheckpoint]) -> Dict:
+    summary = {"sync_mode": sync_mode, "cleared": None, "upsert": None, "results": [], "written_count": 0,
+               "skipped_rows": checkpoint.completed_row_count if checkpoint is not None else 0}
+
+    # Xóa dữ liệu cũ nếu được chọn (vừa lấy danh sách ID vừa xóa song song).
+    # Khi tiếp tục job đã xóa xong thì bỏ qua để không xóa mất dữ liệu vừa ghi
+    if sync_mode == "replace" and not (checkpoint is not None and checkpoint.meta.get("cleared")):
+        job.set_phase("🗑️ Xóa dữ liệu cũ")
+        summary["cleared"] = record_manager.clear_table(app_token, table_id, progress_callback=job.update)
+        if summary["cleared"]["error_batches"]:
+            # Dừng trước khi ghi: checkpoint chưa đánh dấu cleared nên lần tiếp tục sẽ xóa lại từ đầu,
+            # nếu đã ghi dữ liệu mới thì lần xóa đó sẽ xóa luôn các dòng vừa ghi
+            raise LarkbaseApiError(
+                f"Xóa dữ liệu cũ còn {summary['cleared']['error_batches']} batch lỗi, chưa ghi dữ liệu mới: "
+                f"{summary['cleared']['errors'][0].get('msg') or summary['cleared']['errors'][0].get('exception')}"
+            )
+        if checkpoint is not None:
+            checkpoint.update(cleared=True)
+
+    if sync_mode == "upsert":
+        # Đồng bộ theo khóa tự bỏ qua các dòng không đổi nên tiếp tục = chạy lại trên ảnh chụp dữ liệu
+        job.set_phase("🔑 Đồng bộ theo cột khóa")
+        upsert = record_manager.sync_records_by_key(
+            df, key_columns, app_token, table_id, delete_missing=delete_missing, progress_callback=job.update
+        )
+        summary["upsert"] = {k: upsert[k] for k in ("existing", "created", "updated", "deleted", "unchanged")}
+        summary["cleared"] = upsert["delete_result"]
+        summary["results"] = upsert["create_results"] + upsert["update_results"]
+        summary["written_count"] = upsert["created"] + upsert["updated"]
+    elif stream_sql:
+        job.set_phase("⚡ Streaming dữ liệu từ BigQuery")
+        stream_result = stream_query_to_larkbase(
+            stream_sql, record_manager, app_token, table_id, progress_callback=job.update, client=bigquery_client,
+            checkpoint=checkpoint
+        )
+        summary["results"] = stream_result["results"]
+        summary["written_count"] = stream_result["total_rows"]
+    else:
+        # Ghi dữ liệu mới (DataFrame được format theo cột dựa trên schema bảng)
+        job.set_phase("📝 Ghi dữ liệu mới")
+        positions = checkpoint.pending_rows(len(df)) if checkpoint is not None else np.arange(len(df))
+        pending_df = df.iloc[positions] if len(positions) < len(df) else df
+
+        def batch_done(start: int, end: int, result: Dict):
+            if checkpoint is not None and result["status"] == "success":
+                checkpoint.record_rows(positions[start:end], result.get("record_ids", []))
+
+        if len(pending_df):
+            summary["results"] = record_manager.batch_create_records(
+                pending_df, app_token, table_id, progress_callback=job.update, on_batch_done=batch_done
+            )
+            for result in summary["results"]:
+                _to_absolute_rows(result, positions)
+        summary["written_count"] = len(pending_df)
+
+    return summary